@@ -0,0 +1,105 @@
+"""
+Created on 17 oct. 2026
+
+Parity check of the trade section parsers on synthetic saves: the trade data every parser makes must be exactly the
+same as that of the pyparsing grammar, which the hand-written parsers replace, also after handing the trade section
+to and the trade data back from the parse worker through shared memory. Exits with status 1 if it isn't.
+
+Run from the repository root:
+    python -m benchmarks.parity --seeds 3
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root_dir, "src"))
+
+import TradeParser  # noqa: E402
+import binarysave  # noqa: E402
+import handoff  # noqa: E402
+import savefile  # noqa: E402
+import tradeviz  # noqa: E402
+
+from benchmarks import synthetic  # noqa: E402
+
+
+# Metrics report handed back with the trade data by parse_shared
+METRICS = {"stages": {"parse": {"wall": 1.0, "cpu": 1.0, "peak_bytes": 0, "calls": 1, "counters": {"nodes": 1}}}}
+
+
+def parse_shared(section):
+    """Parse a trade section the way the parse worker does: shared by the UI process, parsed straight from shared
+    memory, and the trade data handed back with METRICS in another shared memory block"""
+
+    section_block, handle = handoff.share_section(section)
+    try:
+        with handoff.open_section(handle) as shared_section:
+            if isinstance(shared_section, binarysave.BinarySection):
+                trade_data = binarysave.parse_trade_section(shared_section)
+            else:
+                trade_data = TradeParser.parse_trade_section(shared_section)
+    finally:
+        handoff.remove(section_block)
+
+    data_block, handle = handoff.share_trade_data(trade_data, METRICS)
+    try:
+        return handoff.open_trade_data(handle)
+    finally:
+        handoff.remove(data_block)
+
+
+def check_seed(options, seed, work_dir):
+    """Parse the save made with seed with every parser. Returns the names of the parsers whose trade data differs
+    from that of pyparsing."""
+
+    text = synthetic.save_text(options.nodes, options.countries, options.incoming, options.filler, seed)
+    save_path = os.path.join(work_dir, "synthetic_%i.eu4" % seed)
+    synthetic.write_save(save_path, text)
+    save = savefile.read_trade_section(save_path)
+    binary_path = os.path.join(work_dir, "synthetic_ironman_%i.eu4" % seed)
+    token_path = synthetic.write_binary_save(binary_path, text)
+    binary_save = savefile.read_trade_section(binary_path, token_file=token_path)
+
+    expected = tradeviz.get_trade_data_pyparsing(save.trade_section, 0, logging.getLogger("parity"))
+    expected_shared = dict(expected, metrics=METRICS)
+    results = [
+        ("TradeParser", TradeParser.parse_trade_section(save.trade_section), expected),
+        ("TradeParser parallel", TradeParser.parse_trade_section_parallel(save.trade_section, options.workers),
+         expected),
+        ("binarysave", binarysave.parse_trade_section(binary_save.trade_section), expected),
+        ("TradeParser through shared memory", parse_shared(save.trade_section), expected_shared),
+        ("binarysave through shared memory", parse_shared(binary_save.trade_section), expected_shared),
+    ]
+
+    failed = []
+    for name, trade_data, expected_data in results:
+        same = trade_data == expected_data
+        print("seed %i: %s %s" % (seed, name, "ok" if same else "DIFFERS"))
+        if not same:
+            failed.append(name)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that every parser gives the same trade data as pyparsing")
+    parser.add_argument("--nodes", type=int, default=40, help="number of trade nodes")
+    parser.add_argument("--countries", type=int, default=20, help="country power sections per node")
+    parser.add_argument("--incoming", type=int, default=3, help="incoming routes per node")
+    parser.add_argument("--filler", type=int, default=1000, help="lines of other data around the trade section")
+    parser.add_argument("--workers", type=int, default=2, help="number of workers of the parallel parser")
+    parser.add_argument("--seeds", type=int, default=3, help="number of synthetic saves to check")
+    options = parser.parse_args(argv)
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        for seed in range(options.seeds):
+            failed += len(check_seed(options, seed, work_dir))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
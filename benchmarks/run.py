@@ -0,0 +1,188 @@
+"""
+Created on 17 oct. 2026
+
+Benchmarks for reading, parsing, game data loading and rendering, run on synthetic data so they don't need an EU4
+install. Results are printed (or written) as JSON, so they can be compared across commits.
+
+Run from the repository root:
+    python -m benchmarks.run --nodes 80 --countries 100 --incoming 3 -o bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root_dir, "src"))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+import TradeParser  # noqa: E402
+import binarysave  # noqa: E402
+import gamedata  # noqa: E402
+import handoff  # noqa: E402
+import maprender  # noqa: E402
+import savefile  # noqa: E402
+from tradenetwork import TradeNetwork  # noqa: E402
+
+from benchmarks import synthetic  # noqa: E402
+
+
+def measure(fn, repeat):
+    """Run fn repeat times for wall and CPU time, then once more under tracemalloc for its peak memory use.
+    Returns the result of fn and a dict of the measurements."""
+
+    wall = []
+    cpu = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        result = fn()
+        cpu.append(time.process_time() - c0)
+        wall.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fn()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {"wall_min": min(wall),
+                    "wall_median": statistics.median(wall),
+                    "cpu_median": statistics.median(cpu),
+                    "peak_bytes": peak}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root_dir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options, work_dir):
+    stages = {}
+    text = synthetic.save_text(options.nodes, options.countries, options.incoming, options.filler, options.seed)
+    save_path = os.path.join(work_dir, "synthetic.eu4")
+    zipped_path = os.path.join(work_dir, "synthetic_compressed.eu4")
+    synthetic.write_save(save_path, text)
+    synthetic.write_save(zipped_path, text, compressed=True)
+    install_dir = synthetic.write_install_dir(os.path.join(work_dir, "eu4"), options.nodes, options.provinces,
+                                              options.seed)
+
+    save, stages["read"] = measure(lambda: savefile.read_trade_section(save_path), options.repeat)
+    stages["read"]["bytes"] = os.path.getsize(save_path)
+    _, stages["read_compressed"] = measure(lambda: savefile.read_trade_section(zipped_path), options.repeat)
+    stages["read_compressed"]["bytes"] = os.path.getsize(zipped_path)
+
+    binary_path = os.path.join(work_dir, "synthetic_ironman.eu4")
+    token_path = synthetic.write_binary_save(binary_path, text)
+    binary_save, stages["read_binary"] = measure(
+        lambda: savefile.read_trade_section(binary_path, token_file=token_path), options.repeat)
+    stages["read_binary"]["bytes"] = os.path.getsize(binary_path)
+
+    trade_data, stages["parse"] = measure(lambda: TradeParser.parse_trade_section(save.trade_section),
+                                          options.repeat)
+    stages["parse"]["chars"] = len(save.trade_section)
+    stages["parse"]["nodes"] = len(trade_data["nodeData"])
+
+    # Time until the first node can be drawn while the rest of the trade section is still being parsed
+    _, stages["parse_first_node"] = measure(lambda: next(TradeParser.iter_nodes(save.trade_section)), options.repeat)
+
+    _, stages["parse_binary"] = measure(lambda: binarysave.parse_trade_section(binary_save.trade_section),
+                                        options.repeat)
+    stages["parse_binary"]["bytes"] = len(binary_save.trade_section)
+
+    def handoff_round_trip():
+        """Hand the trade section to and the trade data back from the parse worker through shared memory, without
+        the parsing in between"""
+
+        section_block, section = handoff.share_section(save.trade_section)
+        with handoff.open_section(section) as _text:
+            data_block, data = handoff.share_trade_data(trade_data)
+        handoff.remove(section_block)
+        result = handoff.open_trade_data(data)
+        handoff.remove(data_block)
+        return result
+
+    _, stages["handoff"] = measure(handoff_round_trip, options.repeat)
+    stages["handoff"]["chars"] = len(save.trade_section)
+
+    if options.workers > 1:
+        _, stages["parse_parallel"] = measure(
+            lambda: TradeParser.parse_trade_section_parallel(save.trade_section, options.workers), options.repeat)
+        stages["parse_parallel"]["workers"] = options.workers
+
+    if options.pyparsing:
+        import TradeGrammar
+        _, stages["parse_pyparsing"] = measure(
+            lambda: TradeGrammar.tradeSection.parseString(save.trade_section).asDict(), 1)
+
+    game_data, stages["game_data"] = measure(lambda: gamedata.parse_game_data(install_dir, ""), options.repeat)
+    stages["game_data"]["provinces"] = len(game_data.province_locations)
+
+    network, stages["network"] = measure(lambda: TradeNetwork.from_trade_data(trade_data, game_data.trade_nodes),
+                                         options.repeat)
+    stages["network"]["routes"] = len(network.route_value)
+
+    ratio = options.width / synthetic.MAP_WIDTH
+    renderer = maprender.MapRenderer(synthetic.MAP_WIDTH, synthetic.MAP_HEIGHT, ratio)
+    renderer.set_game_data(game_data.trade_nodes, game_data.province_locations)
+    renderer.network = network
+
+    def intersects():
+        renderer.crossed_routes_key = None
+        return renderer.get_crossed_routes()
+
+    crossed, stages["intersects"] = measure(intersects, options.repeat)
+    stages["intersects"]["crossed"] = len(crossed)
+
+    def render():
+        img = Image.new("RGB", (options.width, int(synthetic.MAP_HEIGHT * ratio)))
+        renderer.draw([maprender.ImageSurface(ImageDraw.Draw(img))], "SWE", "1600.1.1")
+        return img
+
+    _, stages["render"] = measure(render, options.repeat)
+
+    return {"commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": vars(options),
+            "stages": stages}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tradeviz pipeline on synthetic saves")
+    parser.add_argument("--nodes", type=int, default=80, help="number of trade nodes")
+    parser.add_argument("--countries", type=int, default=100, help="country power sections per node")
+    parser.add_argument("--incoming", type=int, default=3, help="incoming routes per node")
+    parser.add_argument("--provinces", type=int, default=4000, help="provinces in positions.txt")
+    parser.add_argument("--filler", type=int, default=200000, help="lines of other data around the trade section")
+    parser.add_argument("--width", type=int, default=1920, help="width of the rendered map")
+    parser.add_argument("--workers", type=int, default=1, help="also benchmark the parallel parser with this many")
+    parser.add_argument("--pyparsing", action="store_true", help="also benchmark the (slow) pyparsing grammar")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of printing it")
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        report = run(options, work_dir)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Created on 17 oct. 2026
+
+Generator for synthetic EU4 saves and game files. The trade section follows the node, country power and incoming
+blocks of TradeGrammar, so it can be read by both the pyparsing grammar and TradeParser. The tradenodes and positions
+files follow NodeGrammar and the positions regex used by gamedata.
+"""
+
+import os
+import random
+import re
+import struct
+import zipfile
+
+import binarysave
+
+MAP_WIDTH = 5632
+MAP_HEIGHT = 2048
+
+
+def node_name(i):
+    return "node_%i" % i
+
+
+def country_tag(i):
+    return chr(ord("A") + i // 100 % 26) + "%02d" % (i % 100)
+
+
+def country_power_section(r, tag):
+    """One country's power in a node, in the (AOW/ED and later) format of TradeGrammar.countryPowerSection"""
+
+    if r.random() < 0.1:  # observers without any power in the node
+        return "\t\t%s={\n\t\t\tmax_demand=%.3f\n\t\t}\n" % (tag, r.random())
+
+    lines = ["\t\t%s={" % tag,
+             "\t\t\ttype=%i" % r.randint(0, 1),
+             "\t\t\tval=%.3f" % (r.random() * 100),
+             "\t\t\tprev=%.3f" % (r.random() * 100),
+             "\t\t\tmax_pow=%.3f" % (r.random() * 100),
+             "\t\t\tmax_demand=%.3f" % (r.random() * 10),
+             "\t\t\tprovince_power=%.3f" % (r.random() * 50),
+             "\t\t\tship_power=%.3f" % (r.random() * 20),
+             "\t\t\tpower_fraction=%.3f" % r.random(),
+             "\t\t\tmoney=%.3f" % (r.random() * 5),
+             "\t\t\ttotal=%.3f" % (r.random() * 100),
+             "\t\t\tsteer_power=%.3f" % r.random(),
+             "\t\t\tadd=%.3f" % r.random(),
+             "\t\t\thas_trader=%s" % r.choice(["yes", "no"]),
+             "\t\t\thas_capital=%s" % r.choice(["yes", "no"]),
+             "\t\t\tt_out=%.3f" % r.random(),
+             "\t\t\tt_in=%.3f" % r.random(),
+             "\t\t\tt_to={\n\t\t\t\t%s=%.3f\n\t\t\t}" % (tag, r.random()),
+             "\t\t}"]
+    return "\n".join(lines) + "\n"
+
+
+def trade_section(n_nodes=80, countries_per_node=100, incoming_routes=3, seed=0):
+    """The text following 'trade=' in a save, with n_nodes nodes that each have countries_per_node country power
+    sections and incoming_routes incoming routes"""
+
+    r = random.Random(seed)
+    out = ["{\n"]
+    for i in range(n_nodes):
+        out.append("\tnode={\n"
+                   "\t\tdefinitions=\"%s\"\n"
+                   "\t\tcurrent=%.3f\n"
+                   "\t\tlocal_value=%.3f\n"
+                   "\t\toutgoing=%.3f\n"
+                   "\t\tvalue_added_outgoing=%.3f\n"
+                   "\t\tretention=%.3f\n"
+                   "\t\tsteer_power=%.3f\n"
+                   "\t\tnum_collectors=%i\n"
+                   "\t\ttotal=%.3f\n"
+                   "\t\tprovince_power=%.3f\n"
+                   "\t\tmax=%.3f\n"
+                   "\t\tcollector_power=%.3f\n"
+                   "\t\tpull_power=%.3f\n"
+                   "\t\tretain_power=%.3f\n"
+                   "\t\thighest_power=%.3f\n" %
+                   (node_name(i), r.random() * 100, r.random() * 40, r.random() * 30, r.random() * 5, r.random(),
+                    r.random(), r.randint(0, 5), r.random() * 500, r.random() * 200, r.random() * 100,
+                    r.random() * 100, r.random() * 100, r.random() * 100, r.random() * 100))
+
+        for c in range(countries_per_node):
+            out.append(country_power_section(r, country_tag(c)))
+
+        for _ in range(incoming_routes):
+            out.append("\t\tincoming={\n\t\t\tadd=%.3f\n\t\t\tvalue=%.3f\n\t\t\tfrom=%i\n\t\t}\n" %
+                       (r.random(), r.random() * 20, r.randint(1, n_nodes)))
+
+        out.append("\t\ttrade_goods_size={\n\t\t\t%s\n\t\t}\n" % " ".join("%.3f" % r.random() for _ in range(30)))
+        out.append("\t\ttop_provinces={\n\t\t\t\"%s\"\n\t\t}\n" % country_tag(0))
+        out.append("\t\ttop_provinces_values={\n\t\t\t%.3f\n\t\t}\n" % r.random())
+        out.append("\t\ttop_power={\n\t\t\t\"%s\"\n\t\t}\n" % country_tag(0))
+        out.append("\t\ttop_power_values={\n\t\t\t%.3f\n\t\t}\n" % r.random())
+        out.append("\t}\n")
+    out.append("}\n")
+    return "".join(out)
+
+
+def save_text(n_nodes=80, countries_per_node=100, incoming_routes=3, filler_lines=200000, seed=0):
+    """A complete uncompressed save with a trade section surrounded by filler_lines of irrelevant data on both
+    sides, like the province and country history in a real save"""
+
+    filler = "".join("\tfiller_%i=%i\n" % (i % 1000, i) for i in range(filler_lines))
+    return ("EU4txt\n"
+            "date=1600.1.1\n"
+            "save_game=\"synthetic.eu4\"\n"
+            "player=\"SWE\"\n"
+            "savegame_version={\n\tfirst=1\n\tsecond=35\n\tthird=3\n\tforth=0\n}\n"
+            "speed=2\n" +
+            "history={\n" + filler + "}\n" +
+            "trade=" + trade_section(n_nodes, countries_per_node, incoming_routes, seed) +
+            "production_leader=\"SWE\"\n" +
+            "countries={\n" + filler + "}\n")
+
+
+def write_save(path, text, compressed=False):
+    """Write a save, optionally compressed the way EU4 does with a separate meta and gamestate entry"""
+
+    if compressed:
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("meta", text[:text.index("speed=")])
+            z.writestr("gamestate", text)
+    else:
+        with open(path, "w", encoding="latin-1", newline="\n") as f:
+            f.write(text)
+
+
+_TEXT_TOKEN = re.compile(r'\s*(?:([{}=])|"([^"]*)"|([^\s{}="]+))')
+_DATE = re.compile(r"(-?\d+)\.(\d+)\.(\d+)$")
+_CONTROL = {"=": binarysave.EQUALS, "{": binarysave.OPEN, "}": binarysave.CLOSE}
+
+
+def encode_date(year, month, day):
+    return ((year + 5000) * 365 + sum(binarysave.MONTH_DAYS[:month - 1]) + day - 1) * 24
+
+
+def binary_save(text):
+    """Encode a text save as a binary (Ironman) one. Returns the data and the token table of the field names in it,
+    which uses the known ids from binarysave.TOKENS where there are any."""
+
+    tokens = dict(binarysave.TOKENS)
+    ids = {name: token for token, name in tokens.items()}
+    next_id = 0x3000
+    out = [binarysave.MAGIC]
+    u16 = struct.Struct("<H").pack
+    after_equals = False
+
+    for control, quoted, word in _TEXT_TOKEN.findall(text[len("EU4txt"):]):
+        if control:
+            out.append(u16(_CONTROL[control]))
+        elif not word:  # quoted string
+            data = quoted.encode("latin-1")
+            out.append(u16(binarysave.STRING_TYPES[0]) + u16(len(data)) + data)
+        elif re.match(r"-?\d+$", word):
+            out.append(u16(0x000c) + struct.pack("<i", int(word)))
+        elif re.match(r"-?\d*\.\d+$", word):
+            out.append(u16(0x000d) + struct.pack("<i", round(float(word) * 1000)))
+        elif _DATE.match(word):
+            out.append(u16(0x000c) + struct.pack("<i", encode_date(*map(int, _DATE.match(word).groups()))))
+        elif after_equals and word in ("yes", "no"):
+            out.append(u16(binarysave.BOOL) + bytes([word == "yes"]))
+        else:
+            if word not in ids:
+                ids[word] = next_id
+                tokens[next_id] = word
+                next_id += 1
+            out.append(u16(ids[word]))
+        after_equals = control == "="
+
+    return b"".join(out), tokens
+
+
+def write_binary_save(path, text, compressed=False):
+    """Write text as a binary save, plus a token file for it next to it. Returns the path of the token file."""
+
+    data, tokens = binary_save(text)
+    if compressed:
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("meta", data[:200])
+            z.writestr("gamestate", data)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+    token_path = os.path.splitext(path)[0] + ".tokens"
+    with open(token_path, "w", encoding="utf-8") as f:
+        for token, name in sorted(tokens.items()):
+            f.write("0x%04x %s\n" % (token, name))
+    return token_path
+
+
+def node_location(i):
+    """Province id of the location of node i"""
+
+    return i + 1
+
+
+def tradenodes_text(n_nodes=80, seed=0):
+    """Contents of a common/tradenodes/00_tradenodes.txt for n_nodes nodes"""
+
+    r = random.Random(seed)
+    out = ["# Synthetic trade nodes\n"]
+    for i in range(n_nodes):
+        out.append("%s = {\n\tlocation = %i\n\tcolor = { %i %i %i }\n" %
+                   (node_name(i), node_location(i), r.randint(0, 255), r.randint(0, 255), r.randint(0, 255)))
+        if i + 1 < n_nodes:
+            out.append("\toutgoing = {\n\t\tname = \"%s\"\n\t\tpath = { %i %i }\n\t\tcontrol = { 1.0 2.0 3.0 4.0 }\n"
+                       "\t}\n" % (node_name(i + 1), node_location(i), node_location(i + 1)))
+        out.append("\tmembers = { %s }\n" % " ".join(str(node_location(i) + k * n_nodes) for k in range(20)))
+        if i + 1 == n_nodes:
+            out.append("\tend = yes\n")
+        out.append("}\n")
+    return "".join(out)
+
+
+def positions_text(n_provinces=4000, seed=0):
+    """Contents of a map/positions.txt for n_provinces provinces"""
+
+    r = random.Random(seed)
+    out = []
+    for i in range(1, n_provinces + 1):
+        coords = " ".join("%.3f %.3f" % (r.uniform(0, MAP_WIDTH), r.uniform(0, MAP_HEIGHT)) for _ in range(7))
+        out.append("#Province %i\n%i={\n\tposition={\n\t\t%s\n\t}\n\trotation={\n\t\t0.000 0.000 0.000 0.000 0.000 "
+                   "0.000 0.000\n\t}\n\theight={\n\t\t0.000 0.000 0.000 0.000 0.000 0.000 0.000\n\t}\n}\n" %
+                   (i, i, coords))
+    return "".join(out)
+
+
+def write_install_dir(root, n_nodes=80, n_provinces=4000, seed=0):
+    """Create a minimal fake EU4 install dir containing only the files gamedata reads"""
+
+    os.makedirs(os.path.join(root, "common", "tradenodes"), exist_ok=True)
+    os.makedirs(os.path.join(root, "map"), exist_ok=True)
+    with open(os.path.join(root, "common", "tradenodes", "00_tradenodes.txt"), "w", encoding="latin-1") as f:
+        f.write(tradenodes_text(n_nodes, seed))
+    with open(os.path.join(root, "map", "positions.txt"), "w", encoding="latin-1") as f:
+        f.write(positions_text(max(n_provinces, n_nodes), seed))
+    return root
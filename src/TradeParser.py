@@ -0,0 +1,261 @@
+"""
+Created on 17 oct. 2026
+
+Hand-written single pass parser for the trade section of EU4 save files. Produces the same payload as parsing
+TradeGrammar.tradeSection, but only looks at the handful of keys the visualizer uses and skips every other block
+(country power sections, top provinces, etc.) by matching braces instead of tokenizing them.
+"""
+
+import multiprocessing as mp
+import re
+
+# Bump whenever the parsed output changes, so cached results from older versions aren't used
+PARSER_VERSION = 1
+
+# One token: a brace or equals sign, a quoted string or a bare word/number
+_TOKEN = re.compile(r'\s*(?:([{}=])|"([^"]*)"|([^\s{}="]+))')
+
+# Which nested blocks to descend into, per level. Everything else is skipped.
+NODE_BLOCKS = {"incoming": {}}
+TRADE_BLOCKS = {"node": NODE_BLOCKS}
+
+MAX_KEYS = ("maxCurrent", "maxLocal", "maxIncoming")
+
+
+class TradeParseError(Exception):
+    def __init__(self, msg, line=0):
+        Exception.__init__(self, msg, line)  # keep the arguments so the error survives pickling by a worker pool
+        self.message = msg
+        self.line = line
+
+    def __str__(self):
+        return "%s (line:%i)" % (self.message, self.line)
+
+
+class _Reader:
+    """Tokenizer over a Clausewitz style key=value / { } text, keeping track of its position"""
+
+    def __init__(self, text, pos=0):
+        self.text = text
+        self.pos = pos
+
+    def error(self, msg):
+        return TradeParseError(msg, self.text.count("\n", 0, self.pos) + 1)
+
+    def next_token(self):
+        m = _TOKEN.match(self.text, self.pos)
+        if m is None:
+            raise self.error("Unexpected end of trade section")
+        self.pos = m.end()
+        return m.groups()
+
+    def open_block(self):
+        brace, _quoted, _word = self.next_token()
+        if brace != "{":
+            raise self.error("Expected '{'")
+
+    def skip_block(self):
+        """Move past the closing brace of the block whose opening brace was just read"""
+
+        text = self.text
+        pos = self.pos
+        depth = 1
+        while depth:
+            close = text.find("}", pos)
+            if close < 0:
+                raise self.error("Unbalanced braces")
+            opened = text.find("{", pos, close)
+            if opened < 0:
+                depth -= 1
+                pos = close + 1
+            else:
+                depth += 1
+                pos = opened + 1
+        self.pos = pos
+
+    def entries(self, descend):
+        """Yield the (key, value) pairs of the current block up to its closing brace. Values of blocks listed in
+        descend are lists of their own entries, other blocks and bare list values are skipped."""
+
+        text = self.text
+        match = _TOKEN.match
+        while True:
+            brace, quoted, word = self.next_token()
+            if brace == "}":
+                return
+            if brace == "{":  # anonymous block inside a list
+                self.skip_block()
+                continue
+            if brace == "=":
+                raise self.error("Unexpected '='")
+
+            key = word if quoted is None else quoted
+            m = match(text, self.pos)
+            if m is None or m.group(1) != "=":  # bare value in a list
+                continue
+            self.pos = m.end()
+
+            brace, quoted, word = self.next_token()
+            if brace == "{":
+                if key in descend:
+                    yield key, list(self.entries(descend[key]))
+                else:
+                    self.skip_block()
+            elif brace is None:
+                yield key, word if quoted is None else quoted
+            else:
+                raise self.error("Expected a value after '%s='" % key)
+
+
+def node_record(entries):
+    """Turn the entries of a node={...} block into its name and node dict"""
+
+    name = None
+    node = {}
+    for key, value in entries:
+        if key == "definitions":
+            name = value
+        elif key == "current":
+            node["currentValue"] = float(value)
+        elif key == "local_value":
+            node["localValue"] = float(value)
+        elif key == "outgoing":
+            node["outgoing"] = float(value)
+        elif key == "incoming":
+            incoming = dict(value)
+            node.setdefault("incomingValue", []).append(float(incoming["value"]))
+            node.setdefault("incomingFromNode", []).append(int(incoming["from"]))
+    return name, node
+
+
+def iter_nodes(trade_section_text, progress=None):
+    """Yield (name, node) for every node={...} block in the trade section, as soon as it has been read. If given,
+    progress is called with the number of characters read so far and the total after every node."""
+
+    return read_nodes(_Reader(trade_section_text), len(trade_section_text), progress)
+
+
+def read_nodes(reader, size, progress=None):
+    """Yield (name, node) for every node block read by reader, which is positioned before the opening brace of a
+    trade section of size characters (or bytes)"""
+
+    reader.open_block()
+    for key, entries in reader.entries(TRADE_BLOCKS):
+        if key != "node":
+            continue
+        try:
+            name, node = node_record(entries)
+        except (KeyError, ValueError) as e:
+            raise reader.error("Invalid trade node data: %s" % e)
+        if name is None:
+            raise reader.error("Trade node without definitions")
+        yield name, node
+        if progress is not None:
+            progress(reader.pos, size)
+
+
+def parse_trade_section(trade_section_text, progress=None):
+    """Parse the text following 'trade=' in a save file into node data and the max values used for scaling. See
+    iter_nodes for progress."""
+
+    return collect_trade_data(iter_nodes(trade_section_text, progress))
+
+
+def collect_trade_data(nodes):
+    """Combine (name, node) pairs into the trade data payload with the max values used for scaling"""
+
+    node_data = {}
+    max_current = 0
+    max_local = 0
+    max_incoming = 0
+
+    for name, node in nodes:
+        max_current = max(max_current, node.get("currentValue", 0))
+        max_local = max(max_local, node.get("localValue", 0))
+        if "incomingValue" in node:
+            max_incoming = max(max_incoming, *node["incomingValue"])
+        node_data[name] = node
+
+    return {"nodeData": node_data,
+            "maxCurrent": max_current,
+            "maxLocal": max_local,
+            "maxIncoming": max_incoming}
+
+
+def split_nodes(trade_section_text, n_chunks):
+    """Split the trade section on top level node boundaries into at most n_chunks trade sections of similar size.
+    Returns a list of (text, line offset) tuples."""
+
+    reader = _Reader(trade_section_text)
+    reader.open_block()
+    start = reader.pos
+    boundaries = []
+    while True:
+        brace, _quoted, _word = reader.next_token()
+        if brace == "}":
+            break
+        if brace == "{":
+            reader.skip_block()
+            boundaries.append(reader.pos)
+    end = reader.pos - 1
+
+    chunks = []
+    chunk_size = (end - start) / max(1, n_chunks)
+    chunk_start = start
+    for boundary in boundaries[:-1]:
+        if boundary - chunk_start >= chunk_size:
+            chunks.append((chunk_start, boundary))
+            chunk_start = boundary
+    chunks.append((chunk_start, end))
+
+    return [("{" + trade_section_text[a:b] + "}", trade_section_text.count("\n", 0, a)) for a, b in chunks]
+
+
+def parse_chunk(chunk):
+    """Parse one chunk made by split_nodes, correcting the line numbers of parse errors"""
+
+    text, line_offset = chunk
+    try:
+        return parse_trade_section(text)
+    except TradeParseError as e:
+        raise TradeParseError(e.message, e.line + line_offset)
+
+
+def merge_trade_data(parts):
+    """Combine the results of parsing several chunks of a trade section"""
+
+    merged = {"nodeData": {}, "maxCurrent": 0, "maxLocal": 0, "maxIncoming": 0}
+    for part in parts:
+        merged["nodeData"].update(part["nodeData"])
+        for key in MAX_KEYS:
+            merged[key] = max(merged[key], part[key])
+    return merged
+
+
+def parse_trade_section_parallel(trade_section_text, workers, progress=None, pool=None):
+    """Parse the trade section in chunks of whole nodes across a pool of worker processes. If given, progress is
+    called with the number of characters parsed so far and the total after every chunk. An existing pool can be
+    passed in to reuse its processes, otherwise one is started for this call."""
+
+    chunks = split_nodes(trade_section_text, workers)
+    if len(chunks) < 2:
+        return parse_trade_section(trade_section_text, progress)
+
+    if pool is None:
+        with mp.Pool(len(chunks)) as pool:
+            return parse_chunks(pool, chunks, progress)
+    return parse_chunks(pool, chunks, progress)
+
+
+def parse_chunks(pool, chunks, progress=None):
+    """Parse the chunks made by split_nodes in pool and merge the results"""
+
+    total = sum(len(text) for text, _line_offset in chunks)
+    done = 0
+    parts = []
+    for (text, _line_offset), part in zip(chunks, pool.imap(parse_chunk, chunks)):
+        parts.append(part)
+        done += len(text)
+        if progress is not None:
+            progress(done, total)
+    return merge_trade_data(parts)
@@ -0,0 +1,110 @@
+"""
+Created on 17 oct. 2026
+
+Headless batch renderer: renders the trade maps of one or more save files to images using PIL only, without Tk.
+Saves are processed concurrently in a pool of worker processes.
+
+Example:
+    python batchrender.py --install-dir "/path/to/Europa Universalis IV" -o maps save1.eu4 save2.eu4
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import sys
+
+from PIL import Image, ImageDraw
+
+import TradeParser
+import binarysave
+import cache
+import gamedata
+import maprender
+import savefile
+import util
+from tradenetwork import TradeNetwork
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+province_image = os.path.join(base_dir, "res", "worldmap.gif")
+cache_dir = os.path.join(base_dir, "cache")
+
+
+def render_save(save_path, game_data, options):
+    """Parse a save file and render its trade map. Returns the path of the written image."""
+
+    save = savefile.read_trade_section(save_path, token_file=options.tokens)
+    if isinstance(save.trade_section, binarysave.BinarySection):
+        trade_data = binarysave.parse_trade_section(save.trade_section)
+    else:
+        trade_data = TradeParser.parse_trade_section(save.trade_section)
+
+    map_img = Image.open(province_image).convert("RGB")
+    map_width, map_height = map_img.size
+    map_img.thumbnail((options.width, map_height), Image.BICUBIC)
+
+    renderer = maprender.MapRenderer(map_width, map_height, map_img.size[0] / float(map_width))
+    renderer.set_game_data(game_data.trade_nodes, game_data.province_locations)
+    renderer.network = TradeNetwork.from_trade_data(trade_data, game_data.trade_nodes)
+    renderer.nodes_show = options.nodes_show
+    renderer.arrow_scale = options.arrow_scale
+    renderer.show_zero = not options.hide_zero
+    renderer.draw([maprender.ImageSurface(ImageDraw.Draw(map_img))], save.player, save.date)
+
+    if options.format == "gif":
+        map_img = map_img.convert("P", palette=Image.ADAPTIVE, dither=Image.NONE, colors=8)
+    out_path = os.path.join(options.output, os.path.splitext(os.path.basename(save_path))[0] + "." + options.format)
+    map_img.save(out_path)
+    return out_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the trade maps of EU4 save files without a GUI")
+    parser.add_argument("saves", nargs="+", help="save files to render")
+    parser.add_argument("--install-dir", help="EU4 install dir (searched for if not given)")
+    parser.add_argument("--mod", default="", help="path of the .mod file the saves were played with")
+    parser.add_argument("--tokens", default="", help="token file for reading Ironman saves")
+    parser.add_argument("--nodes-show", default="Total value", choices=["Local value", "Total value"])
+    parser.add_argument("--arrow-scale", default="Square root", choices=["Linear", "Square root", "Logarithmic"])
+    parser.add_argument("--hide-zero", action="store_true", help="don't draw unused trade routes")
+    parser.add_argument("-o", "--output", default=".", help="directory to write the images to")
+    parser.add_argument("--width", type=int, default=1920, help="width of the rendered map in pixels")
+    parser.add_argument("--format", default="gif", choices=["gif", "png"])
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of saves rendered at once")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, options.log_level),
+                        format="[%(asctime)s] %(levelname)s: %(message)s", datefmt="%Y/%m/%d %H:%M:%S")
+
+    install_dir = options.install_dir or util.search_install_dir()
+    if not install_dir or not os.path.exists(install_dir):
+        logging.critical("EU4 installation folder not found, please pass --install-dir")
+        return 2
+
+    game_data = gamedata.load_game_data(install_dir, options.mod,
+                                        cache.DiskCache(os.path.join(cache_dir, "gamedata"), 100 * 2 ** 20))
+    os.makedirs(options.output, exist_ok=True)
+
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max(1, min(options.jobs, len(options.saves)))) as pool:
+        futures = {pool.submit(render_save, save_path, game_data, options): save_path for save_path in options.saves}
+        for future in concurrent.futures.as_completed(futures):
+            save_path = futures[future]
+            try:
+                logging.info("Rendered %s to %s" % (save_path, future.result()))
+            except (savefile.ReadError, TradeParser.TradeParseError, maprender.InvalidTradeNodeException) as e:
+                logging.error("Could not render %s: %s" % (save_path, e.message))
+                failures += 1
+            except (OSError, KeyError) as e:
+                logging.error("Could not render %s: %s" % (save_path, e))
+                failures += 1
+            except Exception:  # anything else wrong with one save is a failure of that save only
+                logging.exception("Could not render %s" % save_path)
+                failures += 1
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Created on 17 oct. 2026
+
+Decoder for binary (Ironman) EU4 save files. After the EU4bin magic the game state is a stream of little endian 16 bit
+tokens: control tokens for '=', '{' and '}', type tokens followed by a typed value, and ids of field names, which are
+looked up in a token table. The trade section is decoded in a single pass straight into the same nodeData structure
+that TradeParser makes from text saves.
+"""
+
+import re
+import struct
+
+import TradeParser
+
+MAGIC = b"EU4bin"
+
+EQUALS = 0x0001
+OPEN = 0x0003
+CLOSE = 0x0004
+STRING_TYPES = (0x000f, 0x0017)  # u16 length, followed by that many bytes
+BOOL = 0x000e
+
+# Fixed size value types: token: (format, divisor). Floats are stored as fixed point numbers.
+VALUE_TYPES = {
+    0x000c: (struct.Struct("<i"), None),  # i32
+    0x000d: (struct.Struct("<i"), 1000.0),  # f32
+    0x0014: (struct.Struct("<I"), None),  # u32
+    0x0167: (struct.Struct("<q"), 32768.0),  # f64
+    0x029c: (struct.Struct("<Q"), None),  # u64
+    0x0317: (struct.Struct("<q"), None),  # i64
+}
+
+_U16 = struct.Struct("<H")
+
+# Number of bytes following every token, except strings: values for value types and nothing for everything else
+_VALUE_SIZES = {token: fmt.size for token, (fmt, _divisor) in VALUE_TYPES.items()}
+_VALUE_SIZES[BOOL] = 1
+
+# A run of tokens other than braces and strings, which can be skipped by the regex engine in one go. Every alternative
+# is decided by its first two bytes, so the run can't get out of step with the tokens.
+_STOP_TOKENS = list(_VALUE_SIZES) + [OPEN, CLOSE] + list(STRING_TYPES)
+_SKIP_RUN = re.compile(b"(?:" + b"|".join(re.escape(_U16.pack(token)) + b"." * size
+                                          for token, size in _VALUE_SIZES.items()) +
+                       b"|(?!" + b"|".join(re.escape(_U16.pack(token)) for token in _STOP_TOKENS) + b")..)*",
+                       re.DOTALL)
+
+# Field names whose token ids are known, see deironman.py. Saves can only be decoded with a complete table for the
+# fields in REQUIRED_TOKENS, which can be given in a token file, see load_tokens.
+TOKENS = {
+    0x2c69: "date",
+    0x2ee1: "dlc_enabled",
+    0x015e: "node",
+    0x2871: "trade",
+    0x2835: "definitions",
+    0x2c09: "has_trader",
+    0x2cad: "current",
+    0x2aa8: "outgoing",
+    0x2da2: "province_trade_power_value",
+    0x2da5: "local_value",
+    0x2da6: "retention",
+    0x2da7: "steer_power",
+    0x2da8: "pull_power",
+    0x2da9: "retain_power",
+    0x2daa: "highest_power",
+    0x2dab: "max_power",
+    0x2dac: "province_power",
+    0x2dad: "power_fraction",
+    0x2dae: "power_fraction_push",
+}
+
+REQUIRED_TOKENS = ("trade", "node", "definitions", "current", "local_value", "outgoing", "incoming", "value", "from")
+
+# Fields holding dates, which are stored as the number of hours since 1 January 5000 BC in years of 365 days
+DATE_FIELDS = {"date", "start_date"}
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class BinaryParseError(TradeParser.TradeParseError):
+    def __init__(self, msg, offset):
+        TradeParser.TradeParseError.__init__(self, "%s at byte %i" % (msg, offset))
+        self.offset = offset
+
+    def __str__(self):
+        return self.message
+
+
+class BinarySection:
+    """The trade section of a binary save, as the bytes following 'trade=' and the token table to decode them with"""
+
+    def __init__(self, data, tokens):
+        self.data = data
+        self.tokens = tokens
+
+    def __len__(self):
+        return len(self.data)
+
+
+def load_tokens(path=""):
+    """Return the known token table, extended with the one in the file at path if given. Every line of a token file
+    holds an id (decimal or 0x hexadecimal) and a field name, in either order. # starts a comment."""
+
+    tokens = dict(TOKENS)
+    if not path:
+        return tokens
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].replace("=", " ").replace(";", " ").split()
+            if len(fields) != 2:
+                continue
+            a, b = fields
+            try:
+                tokens[int(a, 0)] = b
+            except ValueError:
+                tokens[int(b, 0)] = a
+    return tokens
+
+
+def missing_tokens(tokens):
+    """Return the field names needed to decode trade data that aren't in tokens"""
+
+    names = set(tokens.values())
+    return [name for name in REQUIRED_TOKENS if name not in names]
+
+
+def format_date(value):
+    days, _hours = divmod(value, 24)
+    year, day = divmod(days, 365)
+    month = 0
+    while day >= MONTH_DAYS[month]:
+        day -= MONTH_DAYS[month]
+        month += 1
+    return "%i.%i.%i" % (year - 5000, month + 1, day + 1)
+
+
+class _BinaryReader:
+    """Tokenizer over binary save data, with the same interface as TradeParser's text reader"""
+
+    def __init__(self, data, tokens, pos=0):
+        self.data = data
+        self.tokens = tokens
+        self.pos = pos
+
+    def error(self, msg):
+        return BinaryParseError(msg, self.pos)
+
+    def next_token(self):
+        """Read one token. Returns (control, value): control is '=', '{' or '}' for control tokens and None for
+        values, which are decoded, and field names, which are looked up in the token table."""
+
+        data = self.data
+        pos = self.pos
+        if pos + 2 > len(data):
+            raise self.error("Unexpected end of trade section")
+        token = _U16.unpack_from(data, pos)[0]
+        pos += 2
+
+        if token == EQUALS:
+            control, value = "=", None
+        elif token == OPEN:
+            control, value = "{", None
+        elif token == CLOSE:
+            control, value = "}", None
+        elif token in VALUE_TYPES:
+            fmt, divisor = VALUE_TYPES[token]
+            if pos + fmt.size > len(data):
+                raise self.error("Unexpected end of trade section")
+            value = fmt.unpack_from(data, pos)[0]
+            if divisor:
+                value /= divisor
+            pos += fmt.size
+            control = None
+        elif token in STRING_TYPES:
+            if pos + 2 > len(data):
+                raise self.error("Unexpected end of trade section")
+            length = _U16.unpack_from(data, pos)[0]
+            value = bytes(data[pos + 2:pos + 2 + length]).decode("latin-1")
+            pos += 2 + length
+            control = None
+        elif token == BOOL:
+            if pos >= len(data):
+                raise self.error("Unexpected end of trade section")
+            value = data[pos] != 0
+            pos += 1
+            control = None
+        else:
+            control, value = None, self.tokens.get(token, "0x%04x" % token)
+
+        self.pos = pos
+        return control, value
+
+    def peek_equals(self):
+        """Move past the next token if it is '='. Returns whether it was."""
+
+        if self.pos + 2 <= len(self.data) and _U16.unpack_from(self.data, self.pos)[0] == EQUALS:
+            self.pos += 2
+            return True
+        return False
+
+    def open_block(self):
+        control, _value = self.next_token()
+        if control != "{":
+            raise self.error("Expected '{'")
+
+    def skip_block(self):
+        """Move past the closing brace of the block whose opening brace was just read"""
+
+        data = self.data
+        pos = self.pos
+        end = len(data) - 2
+        unpack = _U16.unpack_from
+        skip_run = _SKIP_RUN.match
+        depth = 1
+        while depth:
+            pos = skip_run(data, pos).end()
+            if pos > end:
+                self.pos = pos
+                raise self.error("Unbalanced braces")
+            token = unpack(data, pos)[0]
+            pos += 2
+            if token == CLOSE:
+                depth -= 1
+            elif token == OPEN:
+                depth += 1
+            elif token in STRING_TYPES:
+                pos += 2 + unpack(data, pos)[0]
+            else:  # a value cut off by the end of data
+                self.pos = pos
+                raise self.error("Unexpected end of trade section")
+        self.pos = pos
+
+    def entries(self, descend):
+        """Yield the (key, value) pairs of the current block up to its closing brace. Values of blocks listed in
+        descend are lists of their own entries, other blocks and bare list values are skipped."""
+
+        while True:
+            control, key = self.next_token()
+            if control == "}":
+                return
+            if control == "{":  # anonymous block inside a list
+                self.skip_block()
+                continue
+            if control == "=":
+                raise self.error("Unexpected '='")
+
+            if not self.peek_equals():  # bare value in a list
+                continue
+
+            control, value = self.next_token()
+            if control == "{":
+                if key in descend:
+                    yield key, list(self.entries(descend[key]))
+                else:
+                    self.skip_block()
+            elif control is None:
+                yield key, value
+            else:
+                raise self.error("Expected a value after '%s='" % key)
+
+
+def find_trade_section(data, tokens):
+    """Return the start and end offsets of the trade={...} block in the binary game state data, from its opening
+    brace up to and including its closing brace, or None if there isn't one"""
+
+    trade_id = next((token for token, name in tokens.items() if name == "trade"), None)
+    if trade_id is None:
+        return None
+
+    marker = _U16.pack(trade_id) + _U16.pack(EQUALS) + _U16.pack(OPEN)
+    start = data.find(marker)
+    if start < 0:
+        return None
+    start += 2 * _U16.size
+
+    reader = _BinaryReader(data, tokens, start + _U16.size)
+    reader.skip_block()
+    return start, reader.pos
+
+
+def header_text(data, tokens):
+    """Render the start of the binary game state data as text, for showing the save's date, player and version the
+    same way as those of text saves. Stops at the end of data or at the first value cut off by it."""
+
+    reader = _BinaryReader(data, tokens, len(MAGIC))
+    lines = []
+    key = None
+    while True:
+        try:
+            control, value = reader.next_token()
+        except BinaryParseError:
+            break
+        if control == "=":
+            if lines:
+                lines[-1] += "="
+            continue
+        if control is not None:
+            lines.append(control)
+            key = None
+            continue
+        if lines and lines[-1].endswith("="):
+            if key in DATE_FIELDS and isinstance(value, int):
+                value = format_date(value)
+            elif isinstance(value, bool):
+                value = "yes" if value else "no"
+            elif isinstance(value, str):
+                value = '"%s"' % value
+            lines[-1] += str(value)
+            key = None
+        else:
+            lines.append(str(value))
+            key = value
+    return "\n".join(lines)
+
+
+def iter_nodes(section, progress=None):
+    """Yield (name, node) for every node in the trade section of a binary save (a BinarySection) as soon as it has
+    been decoded, like TradeParser.iter_nodes"""
+
+    return TradeParser.read_nodes(_BinaryReader(section.data, section.tokens), len(section.data), progress)
+
+
+def parse_trade_section(section, progress=None):
+    """Decode the trade section of a binary save (a BinarySection) into node data and the max values used for
+    scaling, like TradeParser.parse_trade_section"""
+
+    return TradeParser.collect_trade_data(iter_nodes(section, progress))
+
+
+def is_binary(magic):
+    return magic[:len(MAGIC)] == MAGIC
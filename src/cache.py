@@ -0,0 +1,97 @@
+"""
+Created on 17 oct. 2026
+
+Small persistent cache of parsed data on disk, one compressed pickle per key, with least recently used eviction
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+
+SAMPLE_SIZE = 1 << 20
+
+
+def file_key(path, *extra):
+    """Fast key for the contents of a file, combining its size and modification time with a hash of its first and
+    last megabyte. Any extra arguments, such as a parser version, are made part of the key as well."""
+
+    stat = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((stat.st_size, stat.st_mtime_ns) + extra).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(SAMPLE_SIZE))
+        if stat.st_size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, stat.st_size - SAMPLE_SIZE))
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def data_key(*parts):
+    """Key for anything that can be described by a tuple of simple values"""
+
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class DiskCache:
+    """Directory of cache entries that is kept under max_bytes by deleting the least recently used entries"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key):
+        """Return the object stored under key, or None if there is no (readable) entry for it"""
+
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                obj = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path)  # mark as recently used
+            return obj
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Discarding unreadable cache entry %s: %s" % (path, e))
+            self.remove(path)
+            return None
+
+    def put(self, key, obj):
+        path = self.path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(zlib.compress(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.error("Could not write cache entry %s: %s" % (path, e))
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes"""
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.debug("Evicting cache entry %s" % path)
+            self.remove(path)
+            total -= size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
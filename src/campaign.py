@@ -0,0 +1,271 @@
+"""
+Created on 17 oct. 2026
+
+Campaign history: the trade data of a whole series of saves, such as the monthly autosaves of a campaign, kept in an
+append-only columnar store so values can be followed over time without parsing every save again. Ingesting a folder
+only reads the saves that are new or changed since the last time.
+
+Example:
+    python campaign.py ingest "/path/to/save games"
+    python campaign.py series "/path/to/save games" sevilla --value current
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+from array import array
+
+import TradeParser
+import binarysave
+import cache
+import savefile
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+campaign_dir = os.path.join(base_dir, "cache", "campaigns")
+
+# Bump whenever the layout of the store changes, older stores are then started over
+HISTORY_VERSION = 1
+
+SAVE_EXTENSION = ".eu4"
+
+# Columns of per node and per route values, one row per node or route of every ingested save, and their array type
+NODE_COLUMNS = {"node": "i", "current": "d", "local": "d", "outgoing": "d"}
+ROUTE_COLUMNS = {"to": "i", "from": "i", "value": "d"}
+NODE_VALUES = {"current": "currentValue", "local": "localValue", "outgoing": "outgoing"}
+
+
+def date_key(date):
+    """Sort key for an EU4 date such as 1444.11.11"""
+
+    try:
+        return tuple(int(part) for part in date.split("."))
+    except ValueError:
+        return (0,)
+
+
+def read_save(path, token_file=""):
+    """Read and parse one save. Returns its date, player and trade data."""
+
+    save = savefile.read_trade_section(path, token_file=token_file)
+    if isinstance(save.trade_section, binarysave.BinarySection):
+        trade_data = binarysave.parse_trade_section(save.trade_section)
+    else:
+        trade_data = TradeParser.parse_trade_section(save.trade_section)
+    return save.date, save.player, trade_data
+
+
+class CampaignHistory:
+    """
+    Store of the node and route values of every save ingested into it. Every column is a file of raw values that rows
+    are only ever appended to. index.jsonl has a line per ingested save with its file key and the range of rows it
+    added, names.txt the node names that the node and route columns refer to by line number.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = []
+        self.names = []
+        self.name_ids = {}
+        self.columns = {}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @classmethod
+    def for_save_dir(cls, save_dir):
+        """The history of the saves in save_dir, kept in the cache folder"""
+
+        return cls(os.path.join(campaign_dir, cache.data_key(os.path.abspath(save_dir), HISTORY_VERSION)))
+
+    def column_path(self, table, name):
+        return os.path.join(self.directory, "%s_%s.bin" % (table, name))
+
+    def load(self):
+        index_path = os.path.join(self.directory, "index.jsonl")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+
+        names_path = os.path.join(self.directory, "names.txt")
+        if os.path.exists(names_path):
+            with open(names_path, encoding="utf-8") as f:
+                self.names = f.read().split("\n")[:-1]
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+
+        for table, columns in (("nodes", NODE_COLUMNS), ("routes", ROUTE_COLUMNS)):
+            for name, typecode in columns.items():
+                column = array(typecode)
+                path = self.column_path(table, name)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        column.frombytes(f.read())
+                self.columns[table, name] = column
+
+    def rows(self, table):
+        """Number of complete rows in table. Rows left over from an interrupted ingest are not counted."""
+
+        names = NODE_COLUMNS if table == "nodes" else ROUTE_COLUMNS
+        return min(len(self.columns[table, name]) for name in names)
+
+    def name_id(self, name, new_names):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            new_names.append(name)
+        return self.name_ids[name]
+
+    def append(self, path, key, date, player, trade_data):
+        """Add the trade data of one save to the store"""
+
+        new_names = []
+        nodes = {name: array(typecode) for name, typecode in NODE_COLUMNS.items()}
+        routes = {name: array(typecode) for name, typecode in ROUTE_COLUMNS.items()}
+        for node_name, node in trade_data["nodeData"].items():
+            node_id = self.name_id(node_name, new_names)
+            nodes["node"].append(node_id)
+            for column, field in NODE_VALUES.items():
+                nodes[column].append(node.get(field, 0.0))
+            for from_node, value in zip(node.get("incomingFromNode", ()), node.get("incomingValue", ())):
+                routes["to"].append(node_id)
+                routes["from"].append(from_node)
+                routes["value"].append(value)
+
+        # Index line last, so an interrupted ingest leaves at most some unused rows at the ends of the columns
+        if new_names:
+            with open(os.path.join(self.directory, "names.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(name + "\n" for name in new_names))
+
+        entry = {"path": os.path.abspath(path), "key": key, "date": date, "player": player}
+        for table, values in (("nodes", nodes), ("routes", routes)):
+            start = self.rows(table)
+            for name, column in values.items():
+                stored = self.columns[table, name]
+                del stored[start:]
+                with open(self.column_path(table, name), "ab") as f:
+                    f.truncate(start * stored.itemsize)
+                    column.tofile(f)
+                stored.extend(column)
+            entry[table] = [start, start + len(column)]
+
+        with open(os.path.join(self.directory, "index.jsonl"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.entries.append(entry)
+
+    def current_entries(self):
+        """The latest ingested version of every save, ordered by date"""
+
+        latest = {}
+        for entry in self.entries:
+            latest[entry["path"]] = entry
+        return sorted(latest.values(), key=lambda entry: date_key(entry["date"]))
+
+    def ingest(self, paths, token_file="", jobs=1):
+        """Add every save in paths that isn't in the store yet, or has changed since it was added. Saves are read in a
+        pool of jobs processes. Returns the number of saves added."""
+
+        known = {entry["key"] for entry in self.entries}
+        todo = []
+        for path in paths:
+            try:
+                key = cache.file_key(path, TradeParser.PARSER_VERSION, token_file)
+            except OSError as e:
+                logging.error("Could not read %s: %s" % (path, e))
+                continue
+            if key not in known:
+                todo.append((path, key))
+
+        if not todo:
+            return 0
+
+        added = 0
+        with concurrent.futures.ProcessPoolExecutor(max(1, min(jobs, len(todo)))) as pool:
+            futures = [(path, key, pool.submit(read_save, path, token_file)) for path, key in todo]
+            for path, key, future in futures:
+                try:
+                    date, player, trade_data = future.result()
+                except (savefile.ReadError, TradeParser.TradeParseError) as e:
+                    logging.error("Could not ingest %s: %s" % (path, e.message))
+                    continue
+                except (OSError, KeyError) as e:
+                    logging.error("Could not ingest %s: %s" % (path, e))
+                    continue
+                except Exception:  # anything else wrong with one save mustn't stop the others from being ingested
+                    logging.exception("Could not ingest %s" % path)
+                    continue
+                self.append(path, key, date, player, trade_data)
+                logging.info("Ingested %s (%s)" % (path, date))
+                added += 1
+        return added
+
+    def ingest_dir(self, save_dir, token_file="", jobs=1):
+        paths = [os.path.join(save_dir, name) for name in sorted(os.listdir(save_dir))
+                 if name.endswith(SAVE_EXTENSION)]
+        return self.ingest(paths, token_file, jobs)
+
+    def node_series(self, node_name, value="current"):
+        """Return (date, value) for the node in every save, ordered by date"""
+
+        node_id = self.name_ids.get(node_name)
+        node_ids = self.columns["nodes", "node"]
+        values = self.columns["nodes", value]
+        series = []
+        for entry in self.current_entries():
+            start, end = entry["nodes"]
+            for row in range(start, end):
+                if node_ids[row] == node_id:
+                    series.append((entry["date"], values[row]))
+                    break
+        return series
+
+    def route_series(self, from_node, to_node_name):
+        """Return (date, value) for the route from node id from_node (as in the save) to the named node in every save,
+        ordered by date"""
+
+        to_id = self.name_ids.get(to_node_name)
+        to_ids = self.columns["routes", "to"]
+        from_ids = self.columns["routes", "from"]
+        values = self.columns["routes", "value"]
+        series = []
+        for entry in self.current_entries():
+            start, end = entry["routes"]
+            for row in range(start, end):
+                if to_ids[row] == to_id and from_ids[row] == from_node:
+                    series.append((entry["date"], values[row]))
+                    break
+        return series
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a history of the trade data in a folder of EU4 saves")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add the new and changed saves in a folder to its history")
+    ingest.add_argument("save_dir")
+    ingest.add_argument("--tokens", default="", help="token file for reading Ironman saves")
+    ingest.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of saves read at once")
+
+    series = commands.add_parser("series", help="print the value of a trade node in every save as CSV")
+    series.add_argument("save_dir")
+    series.add_argument("node", help="trade node name, such as sevilla")
+    series.add_argument("--value", default="current", choices=list(NODE_VALUES))
+
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, options.log_level),
+                        format="[%(asctime)s] %(levelname)s: %(message)s", datefmt="%Y/%m/%d %H:%M:%S")
+
+    history = CampaignHistory.for_save_dir(options.save_dir)
+    if options.command == "ingest":
+        added = history.ingest_dir(options.save_dir, options.tokens, options.jobs)
+        logging.info("Added %i saves, the history now has %i" % (added, len(history.current_entries())))
+    else:
+        print("date,%s" % options.value)
+        for date, value in history.node_series(options.node, options.value):
+            print("%s,%f" % (date, value))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
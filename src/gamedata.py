@@ -0,0 +1,129 @@
+"""
+Created on 17 oct. 2026
+
+Loading the trade node definitions and province positions from the game or mod files. Resolved data is kept in memory
+for the session and cached on disk, keyed by the install dir, mod path and modification times of the files used.
+"""
+
+import logging
+import os
+import re
+import zipfile
+
+import NodeGrammar
+import cache
+import util
+
+TRADE_NODES = r"common/tradenodes/00_tradenodes.txt"
+POSITIONS = r"map/positions.txt"
+
+# Bump whenever the structure of GameData changes, so older cache entries aren't used
+GAME_DATA_VERSION = 1
+
+_loaded = {}
+
+
+class GameData:
+    """Trade nodes as (name, location province id) in node id order, and province positions as (id, x, y) tuples
+    with y measured from the bottom of the map, as in positions.txt"""
+
+    def __init__(self, trade_nodes, province_locations):
+        self.trade_nodes = trade_nodes
+        self.province_locations = province_locations
+
+
+def get_mod_type(mod_path):
+    """Return the mod type ("dir", "zip" or ""), the mod zip path and the mod dir path for a .mod file"""
+
+    mod_zip = mod_path.replace(".mod", ".zip")
+    mod_dir = mod_path.replace(".mod", "")
+
+    mod_type = ""
+    if mod_path and os.path.isdir(mod_dir):
+        mod_type = "dir"
+    elif os.path.exists(mod_zip):
+        mod_type = "zip"
+    return mod_type, mod_zip, mod_dir
+
+
+def find_game_file(install_dir, mod_path, file_name):
+    """Find the file to use for file_name. Returns a tuple of the path of the file or mod zip containing it, and
+    whether it's inside a zip"""
+
+    mod_type, mod_zip, mod_dir = get_mod_type(mod_path)
+
+    if mod_type == "zip":
+        with zipfile.ZipFile(mod_zip) as z:
+            if os.path.normpath(file_name) in z.namelist():
+                logging.debug("Using %s from zipped mod" % file_name)
+                return mod_zip, True
+    elif mod_type == "dir" and os.path.exists(os.path.join(mod_dir, file_name)):
+        logging.debug("Using %s from mod directory" % file_name)
+        return os.path.join(mod_dir, file_name), False
+
+    logging.debug("Using default %s" % file_name)
+    return os.path.join(install_dir, file_name), False
+
+
+def read_game_file(install_dir, mod_path, file_name):
+    path, zipped = find_game_file(install_dir, mod_path, file_name)
+    if zipped:
+        with zipfile.ZipFile(path) as z:
+            with z.open(file_name) as f:
+                return f.read().decode("latin-1")
+
+    with open(path, encoding="latin-1", mode="r") as f:
+        return f.read()
+
+
+def game_data_key(install_dir, mod_path):
+    """Cache key for the game data, which changes whenever one of the files it is read from changes"""
+
+    sources = []
+    for file_name in (TRADE_NODES, POSITIONS):
+        path, zipped = find_game_file(install_dir, mod_path, file_name)
+        sources.append((path, zipped, os.stat(path).st_mtime_ns))
+
+    return cache.data_key(GAME_DATA_VERSION, install_dir, mod_path, sources)
+
+
+def parse_game_data(install_dir, mod_path):
+    """Read and parse the trade nodes and province positions files"""
+
+    txt = util.remove_comments(read_game_file(install_dir, mod_path, TRADE_NODES))
+    parsed_nodes = NodeGrammar.nodes.parseString(txt)
+    logging.info("%i tradenodes found in %i chars" % (len(parsed_nodes), len(txt)))
+    trade_nodes = [(tradeNode["name"], tradeNode["location"]) for tradeNode in parsed_nodes]
+
+    txt = read_game_file(install_dir, mod_path, POSITIONS)
+    locations = re.findall(r"(\d+)=\s*{\s*position=\s*{\s*([\d.]*)\s*([\d.]*)", txt)
+    province_locations = [(int(a), float(b), float(c)) for a, b, c in locations]
+    logging.info("Found %i province locations" % len(province_locations))
+
+    return GameData(trade_nodes, province_locations)
+
+
+def load_game_data(install_dir, mod_path, disk_cache=None):
+    """Retrieve trade node and province information from the game or mod files, parsing them only if they haven't
+    been loaded this session or cached on disk before"""
+
+    try:
+        key = game_data_key(install_dir, mod_path)
+    except (IOError, zipfile.BadZipFile) as e:
+        logging.critical("Could not find game data files: %s" % e)
+        raise
+
+    if key in _loaded:
+        logging.debug("Using game data loaded earlier this session")
+        return _loaded[key]
+
+    game_data = disk_cache.get(key) if disk_cache else None
+    if game_data is None:
+        game_data = parse_game_data(install_dir, mod_path)
+        if disk_cache:
+            disk_cache.put(key, game_data)
+    else:
+        logging.debug("Using cached game data")
+
+    _loaded[key] = game_data
+    return game_data
@@ -0,0 +1,168 @@
+"""
+Created on 17 oct. 2026
+
+Handing trade sections to the parse worker and parsed trade data back through shared memory, so that neither process
+pickles and copies them through a pipe. Only small handles naming the shared memory blocks are sent over the pipe.
+
+The process that creates a block also removes it, once the other process is done with it: on Windows a block
+disappears as soon as no process has it open anymore.
+"""
+
+import json
+import math
+import os
+import struct
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import binarysave
+
+# Trade section in shared memory: its size in bytes, and the token table if it's a binary section, None for text
+SectionHandle = namedtuple("SectionHandle", ["name", "size", "tokens"])
+
+# Trade data in shared memory, see share_trade_data
+TradeDataHandle = namedtuple("TradeDataHandle", ["name", "size"])
+
+MAGIC = b"TVTD"
+_HEADER = struct.Struct("<4sI")  # magic, length of the JSON metadata
+
+# Node values stored as columns of doubles, NaN where a node doesn't have the value
+NODE_FIELDS = ("currentValue", "localValue", "outgoing")
+
+
+def prepare_worker():
+    """Call before starting a worker process that blocks are handed to. On POSIX systems every block that is made or
+    opened is registered with a resource tracker process, which removes the ones still left when the program exits.
+    Starting it first makes the worker share the tracker of this process, so a block is only registered once and is
+    only removed by its creator."""
+
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+
+
+def share_section(trade_section):
+    """Copy a trade section (text or a binarysave.BinarySection) into a new shared memory block. Returns the block and
+    a handle to send to the process that opens it."""
+
+    if isinstance(trade_section, binarysave.BinarySection):
+        data, tokens = trade_section.data, trade_section.tokens
+    else:
+        data, tokens = trade_section.encode("latin-1"), None
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm, SectionHandle(shm.name, len(data), tokens)
+
+
+@contextmanager
+def open_section(handle):
+    """Open a trade section shared by share_section. Text is decoded into a str, binary sections are read straight
+    from shared memory and can only be used inside the with block."""
+
+    shm = shared_memory.SharedMemory(name=handle.name)
+    view = shm.buf[:handle.size]
+    try:
+        if handle.tokens is None:
+            yield str(view, "latin-1")
+        else:
+            yield binarysave.BinarySection(view, handle.tokens)
+    finally:
+        view.release()
+        shm.close()
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def share_trade_data(trade_data, metrics=None):
+    """
+    Store trade data in a new shared memory block, as a JSON header with the node names, max values and metrics,
+    followed by flat columns of 8 byte numbers: the node values in NODE_FIELDS, the start of the incoming routes of
+    every node (plus the end of the last one), and the from node and value of every incoming route. Returns the
+    block and a handle to send to the process that opens it.
+    """
+
+    node_data = trade_data["nodeData"]
+    names = list(node_data)
+    columns = []
+    for field in NODE_FIELDS:
+        columns.append(array("d", (node_data[name].get(field, math.nan) for name in names)))
+
+    starts = array("q", [0])
+    from_nodes = array("q")
+    values = array("d")
+    for name in names:
+        node = node_data[name]
+        from_nodes.extend(node.get("incomingFromNode", ()))
+        values.extend(node.get("incomingValue", ()))
+        starts.append(len(values))
+    columns += [starts, from_nodes, values]
+
+    meta = {"names": names, "routes": len(values), "metrics": metrics}
+    for key in ("maxCurrent", "maxLocal", "maxIncoming"):
+        meta[key] = trade_data[key]
+    meta = json.dumps(meta).encode("utf-8")
+
+    offset = _align(_HEADER.size + len(meta))
+    size = offset + sum(8 * len(column) for column in columns)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    _HEADER.pack_into(shm.buf, 0, MAGIC, len(meta))
+    shm.buf[_HEADER.size:_HEADER.size + len(meta)] = meta
+    for column in columns:
+        shm.buf[offset:offset + 8 * len(column)] = column.tobytes()
+        offset += 8 * len(column)
+    return shm, TradeDataHandle(shm.name, size)
+
+
+def open_trade_data(handle):
+    """Read the trade data shared by share_trade_data, in the same form as the parsers make it. The metrics stored
+    with it, if any, are returned under its "metrics" key."""
+
+    shm = shared_memory.SharedMemory(name=handle.name)
+    try:
+        magic, meta_size = _HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC:
+            raise ValueError("Shared memory block %s doesn't hold trade data" % handle.name)
+        meta = json.loads(bytes(shm.buf[_HEADER.size:_HEADER.size + meta_size]).decode("utf-8"))
+        names = meta["names"]
+        n, n_routes = len(names), meta["routes"]
+
+        offset = _align(_HEADER.size + meta_size)
+        columns = []
+        for typecode, length in [("d", n)] * len(NODE_FIELDS) + [("q", n + 1), ("q", n_routes), ("d", n_routes)]:
+            column = array(typecode)
+            column.frombytes(shm.buf[offset:offset + 8 * length])
+            columns.append(column)
+            offset += 8 * length
+    finally:
+        shm.close()
+
+    starts, from_nodes, values = columns[len(NODE_FIELDS):]
+    node_data = {}
+    for i, name in enumerate(names):
+        node = {field: column[i] for field, column in zip(NODE_FIELDS, columns) if not math.isnan(column[i])}
+        start, end = starts[i], starts[i + 1]
+        if end > start:
+            node["incomingValue"] = values[start:end].tolist()
+            node["incomingFromNode"] = from_nodes[start:end].tolist()
+        node_data[name] = node
+
+    trade_data = {"nodeData": node_data}
+    for key in ("maxCurrent", "maxLocal", "maxIncoming"):
+        trade_data[key] = meta[key]
+    if meta["metrics"]:
+        trade_data["metrics"] = meta["metrics"]
+    return trade_data
+
+
+def remove(shm):
+    """Close and remove a shared memory block made by this process"""
+
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,138 @@
+"""
+Created on 17 oct. 2026
+
+Per-stage instrumentation: wall time, CPU time, peak memory and counters, exported as JSON. A disabled Metrics object
+records nothing and costs next to nothing, so it can be passed around unconditionally.
+
+By default the peak memory of a stage is how much it raised the peak resident memory of the process, which costs
+nothing to measure but is only available on POSIX systems, and is 0 for a stage that stays below an earlier peak.
+Metrics with trace_memory measure the peak of the memory allocated by Python with tracemalloc instead, which slows
+the code down several times, so their timings shouldn't be compared with those of normal runs.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def max_rss():
+    """Peak resident memory of this process in bytes so far, or 0 where it isn't available"""
+
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Metrics:
+    """Measurements for one run of the pipeline, grouped by stage"""
+
+    def __init__(self, enabled=True, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.started = time.time()
+        self.stages = {}
+        self.outer_peaks = []  # traced peak of each stage being measured so far, from the outermost stage in
+
+    def get_stage(self, name):
+        return self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "peak_bytes": 0, "calls": 0, "counters": {}})
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the code in the with block as (part of) stage name. Stages can be nested, the time and memory of
+        the inner stage then count towards the outer one as well."""
+
+        if not self.enabled:
+            yield
+            return
+
+        if self.trace_memory:
+            with self.traced_stage(name):
+                yield
+            return
+
+        before = max_rss()
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield
+        finally:
+            cpu = time.process_time() - c0
+            wall = time.perf_counter() - t0
+            self.record(name, wall, cpu, max_rss() - before)
+
+    @contextmanager
+    def traced_stage(self, name):
+        """stage, with the peak memory measured with tracemalloc. Tracing is started if needed, and stopped again by
+        the stage that started it. An inner stage resets the traced peak, so the peak of the outer stage up to then
+        is kept in outer_peaks."""
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.outer_peaks:
+            self.outer_peaks[-1] = max(self.outer_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        before, _peak = tracemalloc.get_traced_memory()
+        self.outer_peaks.append(before)
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield
+        finally:
+            cpu = time.process_time() - c0
+            wall = time.perf_counter() - t0
+            peak = max(tracemalloc.get_traced_memory()[1], self.outer_peaks.pop())
+            if self.outer_peaks:
+                self.outer_peaks[-1] = max(self.outer_peaks[-1], peak)
+            if started_tracing:
+                tracemalloc.stop()
+            self.record(name, wall, cpu, peak - before)
+
+    def record(self, name, wall, cpu=0.0, peak_bytes=0):
+        """Add an externally measured duration to stage name"""
+
+        if not self.enabled:
+            return
+        stage = self.get_stage(name)
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["peak_bytes"] = max(stage["peak_bytes"], peak_bytes)
+        stage["calls"] += 1
+
+    def count(self, name, counter, value):
+        """Add value to a counter of stage name, e.g. the number of bytes read"""
+
+        if not self.enabled:
+            return
+        counters = self.get_stage(name)["counters"]
+        counters[counter] = counters.get(counter, 0) + value
+
+    def add(self, report):
+        """Merge the stages of a report made by another process, such as the parse worker"""
+
+        for name, other in report["stages"].items():
+            self.record(name, other["wall"], other["cpu"], other["peak_bytes"])
+            for counter, value in other["counters"].items():
+                self.count(name, counter, value)
+
+    def report(self):
+        return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "sent_at": time.time(),
+                "stages": self.stages}
+
+    def write(self, path):
+        """Append the report as a single JSON line to path"""
+
+        with open(path, "a") as f:
+            f.write(json.dumps(self.report()) + "\n")
+
+
+DISABLED = Metrics(enabled=False)
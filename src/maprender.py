@@ -0,0 +1,472 @@
+"""
+Created on 17 oct. 2026
+
+Drawing the trade network on the world map. The renderer works out where every route, label and node goes and hands
+them to one or more surfaces, such as the Tk canvas or a PIL image, which each draw them in their own way. Nothing in
+here depends on Tk, so maps can also be rendered headless.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from math import sqrt, ceil, log1p
+
+from PIL import Image, ImageDraw
+
+WHITE = "#fff"
+BLACK = "#000"
+
+# Where an arrow ends (on the edge of the target node) and its unit direction there, in map coordinates, and its lines
+# and label position on the map as drawn
+RouteGeometry = namedtuple("RouteGeometry", ["tip", "direction", "lines", "center_of_line"])
+
+# Size in map pixels of the cells of the grid used to find the nodes near a trade route
+GRID_CELL_SIZE = 256
+
+
+class InvalidTradeNodeException(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.message = msg
+
+
+class ImageSurface:
+    """Draws map primitives with a PIL ImageDraw. The image can show part of the map, with its top left corner at
+    origin of the map as drawn, and be scale times its size. shapes and text select what is drawn: lines, arrow heads
+    and circles, or labels, node values and the legend."""
+
+    def __init__(self, draw, scale=1, origin=(0, 0), shapes=True, text=True):
+        self.draw = draw
+        self.scale = scale
+        self.origin = origin
+        self.shapes = shapes
+        self.text = text
+
+    def transform(self, points):
+        """Map x, y, x, y, ... of the map as drawn to the image"""
+
+        ox, oy = self.origin
+        scale = self.scale
+        return [(p - (oy if i % 2 else ox)) * scale for i, p in enumerate(points)]
+
+    def route(self, _key, lines, head, _arrow_shape, color):
+        if self.shapes:
+            for points, width, _arrow in lines:
+                self.draw.line(self.transform(points), width=width * self.scale, fill=color)
+            self.draw.polygon(self.transform(head), outline=color, fill=color)
+        return []
+
+    def route_label(self, _key, center, text):
+        if self.text:
+            x, y = self.transform(center)
+            self.draw.text((x - 4, y - 4), text, fill=WHITE)
+        return []
+
+    def node(self, _key, center, radius, color, value):
+        x, y = self.transform(center)
+        if self.shapes:
+            r = radius * self.scale
+            self.draw.ellipse((x - r, y - r, x + r, y + r), outline=color, fill=color)
+        if self.text:
+            digits = len("%i" % value)
+            self.draw.text((x - 3 * digits, y - 4), "%d" % value, fill=WHITE)
+
+    def legend(self, bottom, player, date, _version):
+        if not self.text:
+            return
+        self.draw.text((10, bottom - 44), "Player: %s" % player, fill=WHITE)
+        self.draw.text((10, bottom - 24), "Date: %s" % date, fill=WHITE)
+
+
+def find_crossed_routes(locations, radii, routes, cell_size=GRID_CELL_SIZE):
+    """
+    Find the trade routes that pass through a trade node circle other than their source and target nodes, in one pass
+    over all routes. locations and radii are indexed by node id - 1, routes are (from node id, to node id) pairs.
+    A route can only cross the circle of a node whose center lies inside the rectangle spanned by its end points, so
+    the node centers are put in a grid and only the nodes in the grid cells covered by that rectangle are tested.
+    See http://mathworld.wolfram.com/Circle-LineIntersection.html
+    """
+
+    grid = {}
+    for n, (nx, ny) in enumerate(locations):
+        grid.setdefault((int(nx // cell_size), int(ny // cell_size)), []).append(n)
+
+    crossed = set()
+    for from_node, to_node in routes:
+        x_from, y_from = locations[from_node - 1]
+        x_to, y_to = locations[to_node - 1]
+        min_x, max_x = min(x_from, x_to), max(x_from, x_to)
+        min_y, max_y = min(y_from, y_to), max(y_from, y_to)
+        dx = x_from - x_to
+        dy = y_from - y_to
+        dr_squared = dx ** 2 + dy ** 2
+
+        for cell_x in range(int(min_x // cell_size), int(max_x // cell_size) + 1):
+            for cell_y in range(int(min_y // cell_size), int(max_y // cell_size) + 1):
+                for n in grid.get((cell_x, cell_y), ()):
+                    nx, ny = locations[n]
+                    if not (min_x < nx < max_x and min_y < ny < max_y):
+                        continue
+
+                    # with the circle center at 0,0
+                    d_area = (x_to - nx) * (y_from - ny) - (x_from - nx) * (y_to - ny)
+                    if radii[n] ** 2 * dr_squared - d_area ** 2 > 0:
+                        logging.debug("Node %i is intersected by a trade route between %i and %i" %
+                                      (n + 1, from_node, to_node))
+                        crossed.add((from_node, to_node))
+                        break
+                else:
+                    continue
+                break
+
+    return crossed
+
+
+class DisplayList:
+    """Records what is drawn on it, so it can be drawn on another surface later, such as an image that is only needed
+    when the map is exported"""
+
+    def __init__(self):
+        self.items = []
+
+    def clear(self):
+        self.items = []
+
+    def route(self, key, lines, head, arrow_shape, color):
+        self.items.append(("route", (key, lines, head, arrow_shape, color)))
+        return []
+
+    def route_label(self, key, center, text):
+        self.items.append(("route_label", (key, center, text)))
+        return []
+
+    def node(self, key, center, radius, color, value):
+        self.items.append(("node", (key, center, radius, color, value)))
+
+    def legend(self, bottom, player, date, version):
+        self.items.append(("legend", (bottom, player, date, version)))
+
+    def __len__(self):
+        return len(self.items)
+
+    def replay(self, surface, start=0, stop=None):
+        """Draw everything recorded since the last clear() on surface, or only the items from start up to stop"""
+
+        for primitive, args in self.items[start:stop]:
+            getattr(surface, primitive)(*args)
+
+
+def draw_overlay(scene, size, origin=(0, 0), supersampling=1):
+    """
+    Draw the routes, labels and nodes in a display list on a transparent image of size, showing the part of the map
+    as drawn from origin on, without the legend. With supersampling, the lines and circles are drawn at that many
+    times the size and scaled down, which smooths their edges, and the text is drawn on top at the normal size.
+    """
+
+    items = DisplayList()
+    items.items = [item for item in scene.items if item[0] != "legend"]
+    if supersampling <= 1:
+        image = Image.new("RGBA", size)
+        items.replay(ImageSurface(ImageDraw.Draw(image), origin=origin))
+        return image
+
+    big = Image.new("RGBA", (size[0] * supersampling, size[1] * supersampling))
+    items.replay(ImageSurface(ImageDraw.Draw(big), supersampling, origin, text=False))
+    image = big.resize(size, Image.BOX)
+    items.replay(ImageSurface(ImageDraw.Draw(image), origin=origin, shapes=False))
+    return image
+
+
+class MapRenderer:
+    """Lays out the trade network of a save on a map of map_width x map_height, drawn at ratio of its size. Every
+    route, route label and node is passed to the surfaces with a key that stays the same across draws, so a surface
+    that keeps its items can update them instead of drawing them again. If a viewport is set, only what overlaps it is
+    drawn."""
+
+    def __init__(self, map_width, map_height, ratio):
+        self.map_width = map_width
+        self.map_height = map_height
+        self.ratio = ratio
+        self.network = None
+        self.trade_nodes = []
+        self.node_locations = []
+        self.nodes_show = "Total value"
+        self.arrow_scale = "Square root"
+        self.show_zero = True
+        self.arrow_labels = []
+        self.zero_items = []
+        self.crossed_routes = set()
+        self.crossed_routes_key = None
+        self.route_geometry = {}
+        self.route_geometry_ratio = ratio
+        self.viewport = None  # x0, y0, x1, y1 of the map as drawn, or None to draw the whole map
+
+    def set_game_data(self, trade_nodes, province_locations):
+        """Use the given trade nodes and province positions, with y measured from the bottom of the map. The map
+        location of every node is looked up once here, so get_node_location doesn't need to search for it."""
+
+        self.trade_nodes = trade_nodes
+        # invert y coordinate :)
+        positions = {i: (x, self.map_height - y) for i, x, y in province_locations}
+        self.node_locations = [positions.get(province_id) for _name, province_id in trade_nodes]
+        self.crossed_routes_key = None
+        self.route_geometry = {}
+
+        for (name, province_id), location in zip(trade_nodes, self.node_locations):
+            if location is None:
+                logging.error("No position found for province %i, the location of trade node %s" % (province_id, name))
+
+    def get_node_name(self, node_id):
+        node = self.trade_nodes[node_id - 1]
+        return node[0]
+
+    def get_node_location(self, node_id):
+        if not 0 < node_id <= len(self.node_locations) or self.node_locations[node_id - 1] is None:
+            raise InvalidTradeNodeException(node_id)
+        return self.node_locations[node_id - 1]
+
+    def get_node_values(self):
+        """Return the column of node values selected by the nodes_show option, and its maximum"""
+
+        if self.nodes_show == "Total value":
+            return self.network.current, self.network.max_current
+        elif self.nodes_show == "Local value":
+            return self.network.local, self.network.max_local
+        else:
+            logging.error("Invalid nodesShow option: %s" % self.nodes_show)
+            return [0] * len(self.network), 0
+
+    def get_node_radius(self, node_id):
+        """Calculate the radius for a trade node given its value"""
+
+        values, max_value = self.get_node_values()
+        value = values[node_id - 1] / max_value if max_value else 0
+
+        return 5 + int(7 * value)
+
+    def get_node_radii(self):
+        """Return the radius of every trade node, indexed by node id - 1"""
+
+        values, max_value = self.get_node_values()
+        return [5 + int(7 * (value / max_value if max_value else 0)) for value in values]
+
+    def get_line_width(self, value) -> float:
+
+        max_incoming = self.network.max_incoming
+
+        if value <= 0:
+            return 1
+
+        elif self.arrow_scale == "Linear":
+            return int(ceil(10 * value / max_incoming))
+
+        elif self.arrow_scale == "Square root":
+            return int(round(10 * sqrt(value) / sqrt(max_incoming)))
+
+        elif self.arrow_scale == "Logarithmic":
+            return int(round(10 * log1p(value) / log1p(max_incoming)))
+
+    def in_view(self, x0, y0, x1, y1):
+        """Check whether a rectangle of the map as drawn overlaps the viewport"""
+
+        if self.viewport is None:
+            return True
+        view_x0, view_y0, view_x1, view_y1 = self.viewport
+        return x0 <= view_x1 and x1 >= view_x0 and y0 <= view_y1 and y1 >= view_y0
+
+    def route_in_view(self, lines, head):
+        xs = [p for points, _width, _arrow in lines for p in points[0::2]] + list(head[0::2])
+        ys = [p for points, _width, _arrow in lines for p in points[1::2]] + list(head[1::2])
+        return self.in_view(min(xs), min(ys), max(xs), max(ys))
+
+    def get_crossed_routes(self):
+        """Return the set of (from node id, to node id) routes that cross a trade node circle. The result is kept until
+        the network, its number of routes, the node radii or the render ratio change."""
+
+        radii = self.get_node_radii()
+        key = (self.network, len(self.network.route_value), self.ratio, radii)
+        if key != self.crossed_routes_key:
+            for n in range(len(self.network)):
+                self.get_node_location(n + 1)  # raises InvalidTradeNodeException for nodes without a location
+            self.crossed_routes = find_crossed_routes(self.node_locations[:len(self.network)],
+                                                      [r / self.ratio for r in radii],
+                                                      [(a, b) for a, b, _value in self.network.routes()])
+            self.crossed_routes_key = key
+        return self.crossed_routes
+
+    def intersects_node(self, node1, node2):
+        """Check whether a trade route intersects a trade node circle (other than source and target nodes)"""
+
+        return (node1, node2) in self.get_crossed_routes()
+
+    def pacific_trade(self, x, y, x2, y2):
+        """Check whether a line goes around the east/west edge of the map"""
+
+        direct_dist = sqrt(abs(x - x2) ** 2 + abs(y - y2) ** 2)
+        x_dist_across = self.map_width - abs(x - x2)
+        dist_across = sqrt(x_dist_across ** 2 + abs(y - y2) ** 2)
+
+        return dist_across < direct_dist
+
+    def get_route_geometry(self, from_node, to_node, to_radius):
+        """Return the geometry of the arrow between two nodes that doesn't depend on the arrow style. It is computed
+        once per route and target node radius, and kept until the game data or render ratio change."""
+
+        bent = (from_node, to_node) in self.crossed_routes
+        key = (from_node, to_node, to_radius, bent)
+        geometry = self.route_geometry.get(key)
+        if geometry is not None:
+            return geometry
+
+        x2, y2 = self.get_node_location(from_node)
+        x, y = self.get_node_location(to_node)
+        is_pacific = self.pacific_trade(x, y, x2, y2)
+
+        # adjust for target node radius
+        dx = x - x2
+        if is_pacific:
+            if x > x2:
+                dx = x2 - self.map_width - x
+            else:
+                dx = self.map_width - x + x2
+        dy = y - y2
+        radius_ratio = max(1.0, sqrt(dx ** 2 + dy ** 2))
+        radius_fraction = to_radius / radius_ratio
+
+        # adjust to stop at node circle's edge
+        x -= 3 * dx * radius_fraction
+        y -= 3 * dy * radius_fraction
+
+        # rescale to unit length
+        dx /= radius_ratio
+        dy /= radius_ratio
+
+        ratio = self.ratio
+
+        # Each line is (points, whether it is drawn with the line width instead of 1, whether it has an arrow head)
+        if not is_pacific:
+            center_of_line = ((x + x2) / 2 * ratio, (y + y2) / 2 * ratio)
+
+            if bent:
+                d = 20
+                center_of_line = (center_of_line[0] + d, center_of_line[1] + d)
+                lines = [((x * ratio, y * ratio, center_of_line[0], center_of_line[1]), True, True),
+                         ((center_of_line[0], center_of_line[1], x2 * ratio, y2 * ratio), True, False)]
+            else:
+                lines = [((x * ratio, y * ratio, x2 * ratio, y2 * ratio), True, True)]
+
+        else:  # Trade route crosses edge of map
+
+            if x < x2:  # Asia to America
+                lines = [((x * ratio, y * ratio, (-self.map_width + x2) * ratio, y2 * ratio), False, True),
+                         (((self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio), False, True)]
+
+                # fraction of trade route left of "date line"
+                f = abs(self.map_width - float(x2)) / (self.map_width - abs(x - x2))
+                # y coordinate where trade route crosses date line
+                yf = y2 + f * (y - y2)
+
+                center_of_line = (x / 2 * ratio, (yf + y) / 2 * ratio)
+
+            else:  # Americas to Asia
+                lines = [((x * ratio, y * ratio, (self.map_width + x2) * ratio, y2 * ratio), False, True),
+                         (((-self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio), False, True)]
+
+                f = abs(self.map_width - float(x)) / (self.map_width - abs(x - x2))
+                yf = y + f * (y2 - y)
+
+                center_of_line = ((self.map_width + x) / 2 * ratio, (yf + y) / 2 * ratio)
+
+        geometry = RouteGeometry((x, y), (dx, dy), lines, center_of_line)
+        self.route_geometry[key] = geometry
+        return geometry
+
+    def draw_arrow(self, surfaces, from_node, to_node, value, to_radius, route_id=0):
+        """Draw an arrow between two nodes on the map. route_id tells the surfaces which route it is."""
+
+        if value <= 0 and not self.show_zero:
+            return
+
+        geometry = self.get_route_geometry(from_node, to_node, to_radius)
+        x, y = geometry.tip
+        dx, dy = geometry.direction
+
+        ratio = self.ratio
+        line_width = self.get_line_width(value)
+        arrow_shape = (max(8.0, line_width * 2), max(10.0, line_width * 2.5), max(5.0, line_width))
+        w = max(5 / ratio, 1.5 * line_width / ratio)
+        line_color = "#000" if value > 0 else "#ff0"
+        head = (x * ratio, y * ratio,
+                (x - w * dx + w * dy) * ratio, (y - w * dx - w * dy) * ratio,
+                (x - w * dx - w * dy) * ratio, (y + w * dx - w * dy) * ratio)
+        lines = [(points, line_width if scaled else 1, arrow) for points, scaled, arrow in geometry.lines]
+
+        items = []
+        if self.viewport is None or self.route_in_view(lines, head):
+            for surface in surfaces:
+                items += surface.route(("route", route_id), lines, head, arrow_shape, line_color)
+
+        self.arrow_labels.append([geometry.center_of_line, value, ("label", route_id)])
+
+        if value == 0:
+            self.zero_items += items
+
+    def draw(self, surfaces, player="", date="", version=""):
+        """Draw the routes, route labels, nodes and legend on all surfaces"""
+
+        ratio = self.ratio
+        self.zero_items = []
+
+        # draw incoming trade arrows
+        t1 = time.time()
+        n_arrows = 0
+        self.arrow_labels = []
+
+        if self.route_geometry_ratio != ratio:
+            self.route_geometry = {}
+            self.route_geometry_ratio = ratio
+
+        if self.network is not None:
+            self.get_crossed_routes()
+            for route_id, (from_node_nr, to_node_nr, value) in enumerate(self.network.routes()):
+                self.draw_arrow(surfaces, from_node_nr, to_node_nr, value, self.get_node_radius(to_node_nr), route_id)
+                n_arrows += 1
+
+        logging.debug("Drew %i arrows in %.2fs" % (n_arrows, time.time() - t1))
+
+        # draw trade arrow labels
+        for [centerOfLine, value, key] in self.arrow_labels:
+            x, y = centerOfLine
+            if (value > 0 or self.show_zero) and self.in_view(x, y, x, y):
+                value_str = "%i" % ceil(value) if (value >= 2 or value <= 0) else ("%.1f" % value)
+                items = []
+                for surface in surfaces:
+                    items += surface.route_label(key, centerOfLine, value_str)
+
+                if value == 0:
+                    self.zero_items += items
+
+        # draw trade nodes and their current value
+        n_nodes = 0
+        node_values = self.get_node_values()[0] if self.network is not None else []
+        trade_node_color = BLACK
+        if self.nodes_show == "Total value":
+            trade_node_color = "#d00"
+        elif self.nodes_show == "Local value":
+            trade_node_color = "#90c"
+
+        for n, v in enumerate(node_values):
+            if not self.network.has_node(n + 1):
+                continue
+            x, y = self.get_node_location(n + 1)
+            s = self.get_node_radius(n + 1)
+            if not self.in_view(x * ratio - s, y * ratio - s, x * ratio + s, y * ratio + s):
+                continue
+
+            for surface in surfaces:
+                surface.node(("node", n + 1), (x * ratio, y * ratio), s, trade_node_color, v)
+            n_nodes += 1
+        logging.debug("Drew %i nodes" % n_nodes)
+
+        for surface in surfaces:
+            surface.legend(self.map_height * ratio, player, date, version)
@@ -0,0 +1,213 @@
+"""
+Created on 17 oct. 2026
+
+Locate the trade section of an EU4 save file by scanning its bytes, so only the header and the trade section itself
+are ever decoded to text
+"""
+
+import logging
+import mmap
+import zipfile
+import zlib
+
+import binarysave
+import instrument
+
+HEADER_SIZE = 2000
+TRADE_START = b"trade="
+TRADE_END = b"production_leader"
+CHUNK_SIZE = 1 << 20
+
+
+class ReadError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.message = msg
+
+
+class SaveSection:
+    """The parts of a save file needed to visualize its trade network"""
+
+    def __init__(self, header, trade_section, pre_trade_section_lines):
+        self.header = header
+        self.trade_section = trade_section
+        self.pre_trade_section_lines = pre_trade_section_lines
+        self.date = ""
+        self.player = ""
+
+        for line in header.split("\n"):
+            if "=" in line:
+                key, val = line.split("=", 1)
+                if key == "date":
+                    self.date = val.strip('" \n')
+                elif key == "player":
+                    self.player = val.strip('" \n')
+                elif key == "speed":
+                    break
+
+
+def count_lines(buf, end):
+    """Count the newlines in buf[:end] without copying all of it at once"""
+
+    lines = 0
+    for pos in range(0, end, CHUNK_SIZE):
+        lines += buf[pos:min(pos + CHUNK_SIZE, end)].count(b"\n")
+    return lines
+
+
+def check_format(magic):
+    """Raise a ReadError unless magic is the start of an uncompressed text save"""
+
+    if magic[:6] != b"EU4txt":
+        logging.error("Savefile starts with %s, not EU4txt" % magic[:10])
+        raise ReadError("appears to be in an invalid format")
+
+
+def extract_trade_section(buf, metrics=instrument.DISABLED, token_file=""):
+    """Find the trade section in the uncompressed save data buf (bytes or mmap) and return it as a SaveSection"""
+
+    if binarysave.is_binary(buf[:10]):
+        return extract_binary_trade_section(buf, metrics, token_file)
+
+    with metrics.stage("read"):
+        check_format(buf[:10])
+
+        start = buf.find(TRADE_START)
+        if start < 0:
+            raise ReadError("does not appear to contain any trade data")
+        end = buf.find(TRADE_END, start)
+        if end < 0:
+            end = len(buf)
+        lines = count_lines(buf, start)
+    metrics.count("read", "bytes", end)
+
+    with metrics.stage("extract"):
+        header = buf[:HEADER_SIZE].decode("latin-1")
+        trade_section = buf[start + len(TRADE_START):end].decode("latin-1")
+    metrics.count("extract", "chars", len(trade_section))
+    logging.debug("Found trade section at bytes %i-%i" % (start, end))
+    return SaveSection(header, trade_section, lines)
+
+
+def extract_binary_trade_section(buf, metrics=instrument.DISABLED, token_file=""):
+    """Find the trade section in the uncompressed binary (Ironman) save data buf and return it as a SaveSection whose
+    trade_section is a binarysave.BinarySection, decoded with the known tokens and those in token_file"""
+
+    try:
+        tokens = binarysave.load_tokens(token_file)
+    except (OSError, ValueError) as e:
+        raise ReadError("is an Ironman save, and the token file %s could not be read (%s)" % (token_file, e))
+    missing = binarysave.missing_tokens(tokens)
+    if missing:
+        raise ReadError("is an Ironman save, which can only be read with a token file that includes %s" %
+                        ", ".join(missing))
+
+    with metrics.stage("read"):
+        try:
+            found = binarysave.find_trade_section(buf, tokens)
+        except binarysave.BinaryParseError as e:
+            raise ReadError("has an unreadable trade section (%s)" % e.message)
+        if found is None:
+            raise ReadError("does not appear to contain any trade data")
+        start, end = found
+    metrics.count("read", "bytes", end)
+
+    with metrics.stage("extract"):
+        header = binarysave.header_text(buf[:HEADER_SIZE], tokens)
+        trade_section = binarysave.BinarySection(bytes(buf[start:end]), tokens)
+    metrics.count("extract", "bytes", len(trade_section))
+    logging.debug("Found binary trade section at bytes %i-%i" % (start, end))
+    return SaveSection(header, trade_section, 0)
+
+
+def stream_trade_section(f, metrics=instrument.DISABLED, token_file=""):
+    """Read the uncompressed save data from the file object f chunk by chunk, only keeping the header and the trade
+    section, and stop reading as soon as the end of the trade section has been found"""
+
+    header = f.read(HEADER_SIZE)
+    if binarysave.is_binary(header):
+        # The end of a binary trade section is only found by decoding it, so the whole game state is read
+        with metrics.stage("decompress"):
+            data = header + f.read()
+        metrics.count("decompress", "bytes", len(data))
+        return extract_binary_trade_section(data, metrics, token_file)
+
+    with metrics.stage("decompress"):
+        header, section, lines, total = _stream_trade_section(f, header)
+    metrics.count("decompress", "bytes", total)
+
+    with metrics.stage("extract"):
+        save = SaveSection(header.decode("latin-1"), section.decode("latin-1"), lines)
+    metrics.count("extract", "chars", len(save.trade_section))
+    return save
+
+
+def _stream_trade_section(f, header):
+    check_format(header)
+    lines = 0
+    keep = len(TRADE_START) - 1  # bytes that might be the start of a marker split across chunks
+    pending = header
+    section = None
+    search_from = 0
+    total = len(header)
+
+    while True:
+        if section is None:
+            start = pending.find(TRADE_START)
+            if start >= 0:
+                lines += pending.count(b"\n", 0, start)
+                section = bytearray(pending[start + len(TRADE_START):])
+            else:
+                scanned = max(0, len(pending) - keep)
+                lines += pending.count(b"\n", 0, scanned)
+                pending = pending[scanned:]
+
+        if section is not None:
+            end = section.find(TRADE_END, search_from)
+            if end >= 0:
+                del section[end:]
+                break
+            search_from = max(0, len(section) - len(TRADE_END) + 1)
+
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            if section is None:
+                raise ReadError("does not appear to contain any trade data")
+            break
+        total += len(chunk)
+        if section is None:
+            pending += chunk
+        else:
+            section += chunk
+
+    logging.debug("Stopped decompressing after %i bytes" % total)
+    return header, section, lines, total
+
+
+def read_zipped_trade_section(path, metrics=instrument.DISABLED, token_file=""):
+    """Extract the trade section of a compressed save file, only inflating the game state up to its end"""
+
+    logging.info("Save file is compressed, unzipping...")
+    try:
+        with zipfile.ZipFile(path) as zipped_save:
+            names = [x for x in zipped_save.namelist() if x.endswith(".eu4") or x == "gamestate"]
+            if not names:
+                raise ReadError("does not contain a game state")
+            with zipped_save.open(names[0]) as f:
+                return stream_trade_section(f, metrics, token_file)
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        raise ReadError("is not a valid compressed save (%s)" % e)
+
+
+def read_trade_section(path, metrics=instrument.DISABLED, token_file=""):
+    """Extract the trade section of the save file at path, memory mapping it if it's not compressed. Binary (Ironman)
+    saves are decoded with the token table extended with token_file, see binarysave.load_tokens."""
+
+    with open(path, "rb") as f:
+        magic = f.read(2)
+        if not magic:
+            raise ReadError("is empty")
+        if magic == b"PK":
+            return read_zipped_trade_section(path, metrics, token_file)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return extract_trade_section(mm, metrics, token_file)
@@ -0,0 +1,92 @@
+"""
+Created on 17 oct. 2026
+
+Tile pyramid of the world map for zooming: the map scaled to every zoom level, cut into square tiles that are made
+when they are first needed and then kept on disk, in a folder per map image so a changed map gets new tiles.
+"""
+
+import hashlib
+import logging
+import os
+
+from PIL import Image
+
+TILE_SIZE = 256
+
+
+def image_key(path):
+    """Hash of the contents of an image file"""
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TilePyramid:
+    """Tiles of the map image at image_path, scaled to a width per zoom level, cached under cache_dir"""
+
+    def __init__(self, image_path, cache_dir, tile_size=TILE_SIZE):
+        self.image_path = image_path
+        self.tile_size = tile_size
+        self.directory = os.path.join(cache_dir, image_key(image_path))
+        self.image = None
+        with Image.open(image_path) as img:
+            self.width, self.height = img.size
+
+    def level_size(self, scale):
+        """Size of the whole map at scale"""
+
+        return int(round(self.width * scale)), int(round(self.height * scale))
+
+    def grid(self, scale):
+        """Number of columns and rows of tiles at scale"""
+
+        width, height = self.level_size(scale)
+        return -(-width // self.tile_size), -(-height // self.tile_size)
+
+    def visible_tiles(self, scale, x0, y0, x1, y1):
+        """(column, row) of the tiles at scale that overlap the rectangle x0, y0, x1, y1 of the scaled map"""
+
+        columns, rows = self.grid(scale)
+        size = self.tile_size
+        return [(col, row)
+                for row in range(max(0, int(y0 // size)), min(rows, int(y1 // size) + 1))
+                for col in range(max(0, int(x0 // size)), min(columns, int(x1 // size) + 1))]
+
+    def tile_path(self, scale, col, row):
+        return os.path.join(self.directory, "%i" % self.level_size(scale)[0], "%i_%i.png" % (col, row))
+
+    def tile(self, scale, col, row):
+        """The tile in column col and row row of the map at scale, as a PIL image"""
+
+        path = self.tile_path(scale, col, row)
+        try:
+            return Image.open(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Making unreadable tile %s again: %s" % (path, e))
+
+        tile = self.make_tile(scale, col, row)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tile.save(path + ".tmp", "PNG")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.warning("Could not cache tile %s: %s" % (path, e))
+        return tile
+
+    def make_tile(self, scale, col, row):
+        """Scale the part of the map covered by a tile"""
+
+        if self.image is None:
+            self.image = Image.open(self.image_path).convert("RGB")
+
+        width, height = self.level_size(scale)
+        size = self.tile_size
+        x0, y0 = col * size, row * size
+        x1, y1 = min(x0 + size, width), min(y0 + size, height)
+        box = (x0 / scale, y0 / scale, min(x1 / scale, self.width), min(y1 / scale, self.height))
+        return self.image.resize((x1 - x0, y1 - y0), Image.BICUBIC, box=box)
@@ -0,0 +1,97 @@
+"""
+Created on 17 oct. 2026
+
+Compact columnar representation of a parsed trade network
+"""
+
+from array import array
+
+
+class TradeNetwork:
+    """Trade node values and incoming trade routes, stored as columns. Node attributes are indexed by node id - 1,
+    routes are stored as parallel from/to/value columns."""
+
+    def __init__(self, names):
+        n = len(names)
+        self.names = list(names)
+        self.ids = {name: i + 1 for i, name in enumerate(self.names)}
+        self.current = array("d", bytes(8 * n))
+        self.local = array("d", bytes(8 * n))
+        self.outgoing = array("d", bytes(8 * n))
+        self.route_from = array("i")
+        self.route_to = array("i")
+        self.route_value = array("d")
+        self.max_current = 0
+        self.max_local = 0
+        self.max_incoming = 0
+        self.added = None  # per node whether it has been added yet, for networks filled by add_nodes
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_trade_data(cls, trade_data, trade_nodes):
+        """Build the network from the output of get_trade_data, using the node order of trade_nodes, a list of
+        (name, location) tuples. Raises a KeyError for nodes that are missing from the trade data."""
+
+        network = cls([name for name, _location in trade_nodes])
+        node_data = trade_data["nodeData"]
+        n_nodes = len(network)
+
+        for i, name in enumerate(network.names):
+            node = node_data[name]
+            network.current[i] = node.get("currentValue", 0)
+            network.local[i] = node.get("localValue", 0)
+            network.outgoing[i] = node.get("outgoing", 0)
+
+            for from_id, value in zip(node.get("incomingFromNode", ()), node.get("incomingValue", ())):
+                if from_id >= n_nodes:
+                    continue
+                network.route_from.append(from_id)
+                network.route_to.append(i + 1)
+                network.route_value.append(value)
+
+        network.max_current = trade_data["maxCurrent"]
+        network.max_local = trade_data["maxLocal"]
+        network.max_incoming = trade_data["maxIncoming"]
+        return network
+
+    def add_nodes(self, nodes):
+        """Add (name, node) pairs as they are parsed, so a network can be drawn while the rest of it is still being
+        parsed. The max values are those of the nodes added so far. Nodes that aren't in the network are ignored."""
+
+        if self.added is None:
+            self.added = bytearray(len(self))
+        n_nodes = len(self)
+
+        for name, node in nodes:
+            node_id = self.ids.get(name)
+            if node_id is None:
+                continue
+            i = node_id - 1
+            self.current[i] = node.get("currentValue", 0)
+            self.local[i] = node.get("localValue", 0)
+            self.outgoing[i] = node.get("outgoing", 0)
+            self.added[i] = 1
+            self.max_current = max(self.max_current, self.current[i])
+            self.max_local = max(self.max_local, self.local[i])
+
+            for from_id, value in zip(node.get("incomingFromNode", ()), node.get("incomingValue", ())):
+                if from_id >= n_nodes:
+                    continue
+                self.route_from.append(from_id)
+                self.route_to.append(node_id)
+                self.route_value.append(value)
+                self.max_incoming = max(self.max_incoming, value)
+
+    def has_node(self, node_id):
+        """Check whether a node is part of the network yet, which is only not the case while it's being filled by
+        add_nodes"""
+
+        return self.added is None or self.added[node_id - 1]
+
+    def routes(self):
+        """Iterate over all routes as (from node id, to node id, value)"""
+
+        return zip(self.route_from, self.route_to, self.route_value)
+
@@ -5,7 +5,6 @@ Created on 21 aug. 2013
 @author: Jeroen Kools
 """
 
-# TODO: implement zoom function
 # TODO: Nodes show options: Player abs trade power, player rel trade power, total trade power
 # TODO: Improve handling of arrows intersecting nodes
 # TODO: Show countries option: all, players, none
@@ -23,11 +22,13 @@ import re
 import os
 import sys
 import json
+from math import ceil
 import zipfile
 import psutil
-from math import sqrt, ceil, log1p
 from packaging import version
 import multiprocessing as mp
+import itertools
+from collections import OrderedDict
 
 # GUI stuff
 import tkinter as tk
@@ -38,12 +39,24 @@ from PIL import Image, ImageTk, ImageDraw
 
 # Tradeviz components
 import pyparsing
-import NodeGrammar
 import TradeGrammar
+import TradeParser
+import binarysave
+import cache
+import gamedata
+import handoff
+import instrument
+import maprender
+import savefile
+import tiles
 import util
+from tradenetwork import TradeNetwork
+from maprender import InvalidTradeNodeException
+from savefile import ReadError
 
 # globals
 province_image = "../res/worldmap.gif"
+cache_dir = "../cache"
 
 # Colors
 VERY_LIGHT_SLATE = "#b2bfc7"
@@ -62,38 +75,341 @@ VERSION = "1.6.0"
 COMPATIBILITY_VERSION = version.Version("1.35.3")  # EU4 version
 APP_NAME = "EU4 Trade Visualizer"
 DEBUG_LEVEL = logging.DEBUG
+METRICS_FILE = None  # set with --metrics[=path] to append a JSON report of every Go click
+METRICS_TRACE_MEMORY = False  # set with --metrics-memory to measure the memory in the report with tracemalloc
+PROGRESS_INTERVAL = 100  # ms between parse progress updates
+ZOOM_LEVELS = (1, 2, 4, 8)  # map sizes relative to the size that fits the screen, selected with the mouse wheel
+VIEW_UPDATE_INTERVAL = 50  # ms between updates of the tiles and trade network in view while dragging the map
+TILE_IMAGES = 256  # number of map tile images kept in memory
+RENDER_BATCH_TIME = 15  # ms spent drawing on the canvas before letting Tk handle input again
+RENDER_BATCH_ITEMS = 50  # display list items drawn between checks of the time
+# Ways to show the trade network: as canvas items, or drawn on one image with the given supersampling
+DISPLAY_MODES = {"Canvas items": 0, "Image": 1, "Antialiased image": 2}
 
 
 class UI:
     def __init__(self):
-        self.arrowLabels = None
         self.arrow_scale_var = None
         self.canvas = None
+        self.canvas_surface = None
+        self.display_list = None
+        self.display_mode_var = None
         self.done = None
         self.goTime = None
-        self.mapDraw = None
         self.map_img = None
         self.mod_path_combo_box = None
         self.mod_path_var = None
         self.nodes_show_var = None
+        self.progress_bar = None
+        self.progress_label = None
+        self.raster_image = None
         self.save_entry = None
         self.show_zero_var = None
+        self.tile_layer = None
 
 
-def get_trade_data(trade_section_text, queue, previous_lines):
-    """Extract the trade data from the selected save file"""
+class ParseJob:
+    """A save file being parsed by the parse worker, whose messages arrive over connection"""
+
+    ids = itertools.count(1)
+
+    def __init__(self, connection, save, cache_key, shared=None, kill_to_cancel=False):
+        self.id = next(self.ids)
+        self.connection = connection
+        self.save = save
+        self.cache_key = cache_key
+        self.shared = shared  # the shared memory block the trade section was handed over in, if any
+        self.kill_to_cancel = kill_to_cancel  # the job can only be cancelled by stopping the worker
+        self.network = None  # the nodes streamed by the worker so far
+        self.streaming = True
+        self.started = time.time()
+
+    def release(self):
+        """Remove the shared trade section, once the worker is done with it"""
+
+        if self.shared is not None:
+            handoff.remove(self.shared)
+            self.shared = None
+
+
+def set_low_priority(pid):
+    """Lower the CPU and I/O priority of a worker process, so it doesn't make the UI sluggish"""
+
+    try:
+        psutil_process = psutil.Process(pid)
+        if sys.platform == "win32":
+            psutil_process.nice(psutil.IDLE_PRIORITY_CLASS)
+            psutil_process.ionice(psutil.IOPRIO_LOW)
+        else:
+            psutil_process.nice(10)
+            psutil_process.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except psutil.Error as e:
+        logging.warning("Could not lower the priority of process %i: %s" % (pid, e))
+
+
+class JobCancelled(Exception):
+    def __init__(self, job_id):
+        Exception.__init__(self, job_id)
+        self.job_id = job_id
+
+
+class ParseWorker:
+    """A long-lived process that parses trade sections, started again if it dies"""
+
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.start()
+
+    def start(self):
+        handoff.prepare_worker()
+        self.connection, worker_connection = mp.Pipe()
+        # Not a daemon, because daemon processes can't start the pool used by the parseWorkers option
+        self.process = mp.Process(target=parse_worker, args=(worker_connection, DEBUG_LEVEL), name="ParseWorker")
+        self.process.start()
+        worker_connection.close()
+        logging.debug("Started parse worker (pid %i)" % self.process.pid)
+
+    def ensure_running(self):
+        """Start a new worker process if the current one died"""
+
+        if not self.process.is_alive():
+            logging.warning("Parse worker stopped with exit code %s, restarting it" % self.process.exitcode)
+            self.connection.close()
+            self.process.close()
+            self.start()
+
+    def submit(self, job_id, *args):
+        """Send a job with the arguments of get_trade_data to the worker. Returns the connection to read it from."""
+
+        self.ensure_running()
+        self.connection.send(("parse", job_id, args))
+        return self.connection
+
+    def cancel(self, job_id, kill=False):
+        """Stop working on a job, by killing the worker if kill is set"""
+
+        if kill:
+            logging.info("Stopping parse worker to cancel job %i" % job_id)
+            self.process.terminate()
+            self.process.join(1)
+            self.ensure_running()
+            return
+        try:
+            self.connection.send(("cancel", job_id))
+        except OSError:
+            pass
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class JobConnection:
+    """The worker's end of the pipe as seen by one job, which raises JobCancelled once the job is cancelled"""
+
+    def __init__(self, connection, job_id, inbox):
+        self.connection = connection
+        self.job_id = job_id
+        self.inbox = inbox
+
+    def send(self, message):
+        if message[0] == "progress":
+            self.check_cancelled()
+        self.connection.send((message[0], self.job_id) + tuple(message[1:]))
+
+    def check_cancelled(self):
+        while self.connection.poll():
+            message = self.connection.recv()
+            self.inbox.append(message)
+            if message is None or message[0] == "parse" or message[1] == self.job_id:
+                raise JobCancelled(self.job_id)
+
+
+def parse_worker(connection, log_level):
+    """Main loop of the parse worker process: parse every job received over connection until None arrives"""
+
     logger = logging.getLogger("trade_process")
-    logger.setLevel(DEBUG_LEVEL)
+    logger.setLevel(log_level)
     handler = logging.FileHandler("tradeviz.log", "a", delay=True)
     handler.setFormatter(logging.Formatter(fmt="[%(asctime)s] %(levelname)s: [%(name)s] %(message)s",
                                            datefmt="%Y/%m/%d %H:%M:%S"))
     logger.addHandler(handler)
-    logger.info("Parsing %i chars" % len(trade_section_text))
+    set_low_priority(os.getpid())
+
+    chunk_pool = None
+    chunk_pool_size = 0
+    result = None
+    inbox = []
+    try:
+        while True:
+            try:
+                message = inbox.pop(0) if inbox else connection.recv()
+            except EOFError:
+                break
+
+            # The main process has read the previous result, or no longer wants it, before sending anything else
+            if result is not None:
+                handoff.remove(result)
+                result = None
+            if message is None:
+                break
+            if message[0] != "parse":  # cancels a job that has already finished
+                continue
+
+            _parse, job_id, job = message
+            job_connection = JobConnection(connection, job_id, inbox)
+            workers = job[3]
+            if workers > 1 and workers != chunk_pool_size:
+                if chunk_pool is not None:
+                    chunk_pool.terminate()
+                chunk_pool = mp.Pool(workers)
+                chunk_pool_size = workers
+
+            try:
+                job_connection.check_cancelled()
+                if isinstance(job[0], handoff.SectionHandle):
+                    with handoff.open_section(job[0]) as trade_section:
+                        trade_data = get_trade_data(trade_section, *job[1:], connection=job_connection,
+                                                    chunk_pool=chunk_pool)
+                else:
+                    trade_data = get_trade_data(*job, connection=job_connection, chunk_pool=chunk_pool)
+            except JobCancelled:
+                logger.info("Cancelled job %i" % job_id)
+                if chunk_pool is not None:  # stop the chunks of the job that are still being parsed
+                    chunk_pool.terminate()
+                    chunk_pool = None
+                    chunk_pool_size = 0
+                continue
+            except FileNotFoundError:
+                logger.info("Skipped job %i, whose trade section was removed before it started" % job_id)
+                continue
+            finally:
+                handler.flush()
+            result = send_result(job_connection, trade_data)
+    finally:
+        if result is not None:
+            handoff.remove(result)
+        if chunk_pool is not None:
+            chunk_pool.terminate()
+
+
+def send_result(connection, trade_data):
+    """Send the trade data to the main process in shared memory if possible. Returns the shared memory block."""
+
+    if trade_data is None:
+        connection.send(("result", None))
+        return None
+
+    metrics = trade_data.pop("metrics", None)
+    try:
+        shared, handle = handoff.share_trade_data(trade_data, metrics)
+    except OSError as e:
+        logging.getLogger("trade_process").warning("Could not share the trade data, sending it instead: %s" % e)
+        if metrics:
+            trade_data["metrics"] = metrics
+        connection.send(("result", trade_data))
+        return None
+
+    connection.send(("result", handle))
+    return shared
+
+
+def get_trade_data(trade_section_text, previous_lines, use_pyparsing=False, workers=1, collect_metrics=False,
+                   trace_memory=False, connection=None, chunk_pool=None):
+    """Extract the trade data from the selected save file"""
+    logger = logging.getLogger("trade_process")
+    binary = isinstance(trade_section_text, binarysave.BinarySection)
+    use_pyparsing = use_pyparsing and not binary
+    logger.info("Parsing %i %s" % (len(trade_section_text), "bytes" if binary else "chars"))
     t0 = time.time()
+    metrics = instrument.Metrics(collect_metrics, trace_memory)
+    last_progress = 0.0
+
+    def send_progress(done, total):
+        nonlocal last_progress
+        now = time.time()
+        if done == total or now - last_progress >= PROGRESS_INTERVAL / 1000:
+            last_progress = now
+            connection.send(("progress", "parsing", done, total))
+
+    def stream_nodes(nodes):
+        """Pass on the nodes read by the parser, sending them to the main process in batches"""
+
+        batch = []
+        last_sent = 0.0
+        for name, node in nodes:
+            batch.append((name, node))
+            yield name, node
+            now = time.time()
+            if now - last_sent >= PROGRESS_INTERVAL / 1000:
+                connection.send(("nodes", batch))
+                batch = []
+                last_sent = now
+
+    send_progress(0, 0 if use_pyparsing else len(trade_section_text))
+
+    with metrics.stage("parse"):
+        if use_pyparsing:
+            trade_data = get_trade_data_pyparsing(trade_section_text, previous_lines, logger)
+        else:
+            try:
+                if binary:
+                    logger.debug("Decoding binary trade section...")
+                    trade_data = TradeParser.collect_trade_data(
+                        stream_nodes(binarysave.iter_nodes(trade_section_text, send_progress)))
+                elif workers > 1:
+                    logger.debug("Parsing trade section with %i workers..." % workers)
+                    trade_data = TradeParser.parse_trade_section_parallel(trade_section_text, workers, send_progress,
+                                                                         chunk_pool)
+                else:
+                    logger.debug("Parsing trade section...")
+                    trade_data = TradeParser.collect_trade_data(
+                        stream_nodes(TradeParser.iter_nodes(trade_section_text, send_progress)))
+            except binarysave.BinaryParseError as e:
+                util.show_error(e, "Can't read file! Error: %s" % e.message)
+                trade_data = None
+            except TradeParser.TradeParseError as e:
+                error_message = "Error: %s (line:%i)" % (e.message, e.line + previous_lines)
+                util.show_error(e, "Can't read file! " + error_message)
+                trade_data = None
+
+    if trade_data is None:
+        return None
+
+    logger.info("Finished parsing save in %.3f seconds" % (time.time() - t0))
+
+    try:
+        logger.debug("Sevilla:\n\t%s" % trade_data["nodeData"]["sevilla"])
+        logger.debug("max current value: %f" % trade_data["maxCurrent"])
+        logger.debug("max incoming value: %f" % trade_data["maxIncoming"])
+    except KeyError:
+        logger.warning("Trade node Sevilla not found! Save file is either from a modded game or malformed!")
+
+    if metrics.enabled:
+        metrics.count("parse", "chars", len(trade_section_text))
+        metrics.count("parse", "nodes", len(trade_data["nodeData"]))
+        metrics.count("parse", "routes", sum(len(node.get("incomingValue", ())) for node in
+                                             trade_data["nodeData"].values()))
+        trade_data["metrics"] = metrics.report()
+
+    return trade_data
+
+
+def get_trade_data_pyparsing(trade_section_text, previous_lines, logger):
+    """Parse the trade section with the (slow) pyparsing grammar. Returns None if the save can't be parsed."""
 
-    logger.debug("Parsing trade section...")
-    result = TradeGrammar.tradeSection.parseString(trade_section_text)
+    # Remove irrelevant, empty country power sections to speed up parsing
+    trade_section_text = re.sub(R"\w{3}={\s+max_demand=[\d.]+\s+}", "", trade_section_text)
+
+    logger.debug("Parsing trade section with pyparsing...")
     try:
+        result = TradeGrammar.tradeSection.parseString(trade_section_text)
         trade_section_dict = result.asDict()
         node_data = {}
     except AttributeError as e:
@@ -113,7 +429,6 @@ def get_trade_data(trade_section_text, queue, previous_lines):
         util.show_error(e, "Can't read file! " + error_message)
         return
 
-    logger.info("Finished parsing save in %.3f seconds" % (time.time() - t0))
     logger.debug("Processing parsed results")
 
     max_current = 0
@@ -138,19 +453,10 @@ def get_trade_data(trade_section_text, queue, previous_lines):
 
         node_data[nodeDict[node_name]["quotedName"][0]] = node
 
-    try:
-        logger.debug("Sevilla:\n\t%s" % node_data["sevilla"])
-        logger.debug("max current value: %f" % max_current)
-        logger.debug("max incoming value: %f" % max_incoming)
-    except KeyError:
-        logger.warning("Trade node Sevilla not found! Save file is either from a modded game or malformed!")
-
-    queue.put({"nodeData": node_data,
-               "maxCurrent": max_current,
-               "maxLocal": max_local,
-               "maxIncoming": max_incoming})
-    handler.flush()
-    sys.exit()
+    return {"nodeData": node_data,
+            "maxCurrent": max_current,
+            "maxLocal": max_local,
+            "maxIncoming": max_incoming}
 
 
 class TradeViz:
@@ -167,14 +473,13 @@ class TradeViz:
         self.root.title("%s v%s" % (APP_NAME, VERSION))
         self.root.bind("<Escape>", lambda x: self.exit("Escape key pressed"))
         self.root.wm_protocol("WM_DELETE_WINDOW", lambda: self.exit("Close Window"))
-        self.zero_arrows = []
+        self.canvas_draw = None
+        self.metrics = instrument.DISABLED
+        self.parse_job = None
+        self.zoom = 1
+        self.view_update = None
         self.config = {}
         self.ui = UI()
-        self.node_data = None
-        self.province_locations = None
-        self.max_incoming = 0
-        self.max_current = 0
-        self.max_local = 0
 
         try:
             self.root.iconbitmap(r"../res/merchant.ico")
@@ -191,20 +496,23 @@ class TradeViz:
             self.map_render_size_ratio = self.map_thumb_size[0] / float(self.map_width)
             logging.debug(f"Map thumb size: {self.map_thumb_size}, render size ratio:{self.map_render_size_ratio:.2f}")
             self.province_image = ImageTk.PhotoImage(self.ui.map_img)
+            self.renderer = maprender.MapRenderer(self.map_width, self.map_height, self.map_render_size_ratio)
         except Exception as e:
             logging.critical("Error preparing the world map!\n%s" % e)
 
         logging.debug("Setting up GUI")
         self.setup_gui()
-        self.trade_nodes = []
         self.player = ""
         self.date = ""
-        self.zoomed = False
         self.save_version = ""
         self.pre_trade_section_lines = 0
         self.root.grid_columnconfigure(1, weight=1)
         self.root.grid_rowconfigure(7, weight=1)
         self.get_config()
+        cache_size = self.config["cacheSizeMB"] * 2 ** 20
+        self.trade_cache = cache.DiskCache(os.path.join(cache_dir, "trade"), cache_size)
+        self.game_data_cache = cache.DiskCache(os.path.join(cache_dir, "gamedata"), cache_size)
+        self.parse_worker = ParseWorker()
         self.root.deiconify()
 
         # self.root.focus_set()
@@ -232,9 +540,13 @@ class TradeViz:
             self.ui.mod_path_combo_box.configure(values=[""] + self.config["modPaths"])
         if "arrowScale" in self.config:
             self.ui.arrow_scale_var.set(self.config["arrowScale"])
+        if self.config.get("displayMode") in DISPLAY_MODES:
+            self.ui.display_mode_var.set(self.config["displayMode"])
 
         defaults = {"savefile": "", "showZeroRoutes": 0, "nodesShow": "Total value",
-                    "modPaths": [], "lastModPath": "", "arrowScale": "Square root"}
+                    "modPaths": [], "lastModPath": "", "arrowScale": "Square root",
+                    "legacyParser": False, "parseWorkers": 1, "cacheSizeMB": 100, "ironmanTokens": "",
+                    "displayMode": "Canvas items"}
 
         for k in defaults:
             if k not in self.config:
@@ -277,7 +589,21 @@ class TradeViz:
         self.ui.canvas = tk.Canvas(self.root, width=self.map_thumb_size[0], height=self.map_thumb_size[1],
                                    highlightthickness=0, border=5, relief="flat", bg=DARK_SLATE)
         self.ui.canvas.grid(row=1, column=0, columnspan=4, sticky="W", padx=5)
+        self.ui.canvas.configure(scrollregion=(0, 0, self.map_thumb_size[0], self.map_thumb_size[1]))
         self.ui.canvas.bind("<Button-1>", self.click_map)
+        self.ui.canvas.bind("<B1-Motion>", self.drag_map)
+        self.ui.canvas.bind("<ButtonRelease-1>", lambda _event: self.update_view())
+        self.ui.canvas.bind("<MouseWheel>", self.wheel_map)
+        self.ui.canvas.bind("<Button-4>", self.wheel_map)
+        self.ui.canvas.bind("<Button-5>", self.wheel_map)
+        self.ui.canvas.create_image((0, 0), image=self.province_image, anchor=tk.NW, tags="map")
+        self.ui.canvas_surface = CanvasSurface(self.ui.canvas)
+        try:
+            pyramid = tiles.TilePyramid(province_image, os.path.join(cache_dir, "tiles"))
+            self.ui.tile_layer = TileLayer(self.ui.canvas, pyramid)
+        except OSError as e:
+            logging.error("Could not open the map for zooming: %s" % e)
+        self.ui.display_list = maprender.DisplayList()
         self.setup_tk_styles()
         self.root.geometry("%dx%d+0+0" % (self.w, self.h))
         self.root.minsize(self.w, self.h - 20)
@@ -330,6 +656,16 @@ class TradeViz:
         self.ui.arrow_scale.grid(row=5, column=1, columnspan=2, sticky="W", padx=6, pady=2)
         self.ui.arrow_scale_var.trace("w", self.arrow_scale_changed)
 
+        tk.Label(self.root, text="Display:", bg=DARK_SLATE, fg=WHITE, font=SMALL_FONT).grid(row=4, column=3,
+                                                                                            padx=(6, 2), pady=2,
+                                                                                            sticky="W")
+        self.ui.display_mode_var = tk.StringVar()
+        self.ui.display_mode_var.set("Canvas items")
+        self.ui.display_mode = ttk.Combobox(self.root, textvariable=self.ui.display_mode_var,
+                                            values=list(DISPLAY_MODES), state="readonly", font=SMALL_FONT)
+        self.ui.display_mode.grid(row=5, column=3, sticky="WE", padx=7, pady=2)
+        self.ui.display_mode_var.trace("w", self.display_mode_changed)
+
         self.ui.show_zero_var = tk.IntVar(value=1)
         self.ui.show_zeroes = tk.Checkbutton(self.root, text="Show unused trade routes",
                                              bg=DARK_SLATE, fg=WHITE, font=SMALL_FONT, selectcolor=MID_SLATE,
@@ -337,6 +673,13 @@ class TradeViz:
                                              variable=self.ui.show_zero_var, command=self.toggle_show_zeroes)
         self.ui.show_zeroes.grid(row=6, column=0, columnspan=2, sticky="W", padx=6, pady=2)
 
+        self.ui.progress_label = tk.Label(self.root, text="", bg=DARK_SLATE, fg=WHITE, font=SMALL_FONT, anchor="w")
+        self.ui.progress_label.grid(row=6, column=2, columnspan=2, sticky="WE", padx=6, pady=2)
+        self.ui.progress_label.grid_remove()
+        self.ui.progress_bar = ttk.Progressbar(self.root, orient="horizontal", mode="determinate", maximum=1.0)
+        self.ui.progress_bar.grid(row=7, column=0, sticky="SWE", padx=7, pady=15)
+        self.ui.progress_bar.grid_remove()
+
         # Buttons
 
         self.ui.browse_file_btn = tk.Button(self.root, text="Browse...", command=self.browse_save,
@@ -418,6 +761,8 @@ class TradeViz:
 
         filename = tkinter.filedialog.askopenfilename(filetypes=[("EU4 Saves", "*.eu4")], initialdir=initial_dir)
         logging.info("Selected save file %s" % os.path.basename(filename))
+        if filename and filename != self.config["savefile"]:
+            self.cancel_parse_job()
         self.config["savefile"] = filename
         self.save_config()
 
@@ -459,150 +804,272 @@ class TradeViz:
     def go(self, _event=None):
         """Start parsing the selected save file and show the results on the map"""
 
+        self.metrics = instrument.Metrics(METRICS_FILE is not None, METRICS_TRACE_MEMORY)
+        parsing = False
+        try:
+            parsing = self.process_save()
+        finally:
+            if not parsing:
+                self.write_metrics()
+
+    def write_metrics(self):
+        if self.metrics.enabled:
+            self.metrics.write(METRICS_FILE)
+
+    def process_save(self):
+        """Read and parse the selected save file and draw the map. Returns True if it's parsed in the background."""
+
         logging.info("Processing save file")
+        self.cancel_parse_job()
         self.ui.done = False
         self.ui.goTime = time.time()
         self.clear_map()
 
         if self.config["savefile"]:
             try:
-                txt = self.get_save_text()
+                with self.metrics.stage("cache"):
+                    cache_key = self.get_cache_key()
+                    cached = self.trade_cache.get(cache_key)
+                if cached is None:
+                    save = self.get_save_text()
             except ReadError as e:
                 util.show_error("Failed to get savefile text: " + e.message,
                                 "This save file %s and can't be processed by %s" % (e.message, APP_NAME))
                 self.draw_map(True)
                 return
 
-            error_message = f"{APP_NAME} could not parse this file. You might be trying to open a corrupted save, " + \
-                            "or a save created with an unsupported mod or game version. "
+            if cached is not None:
+                logging.info("Using cached trade data")
+                self.set_save_info(cached["header"], cached["date"], cached["player"])
+                self.on_parse_complete(cached["tradeData"])
+                self.draw_trade_map()
+                return
+
+            # Hand the trade section to the parse worker in shared memory, instead of pickling it through the pipe
             try:
-                trade_section = txt[1]  # drop part before trade section starts
-                trade_section = trade_section.split("production_leader")[0]  # drop the part after the end
-
-                # Remove irrelevant, empty country power sections to speed up parsing
-                trade_section = re.sub(R"\w{3}={\s+max_demand=[\d.]+\s+}", "", trade_section)
-
-                # Use multiprocessing to parse the save file without blocking the UI thread
-                output_queue = mp.SimpleQueue()
-                trade_process = mp.Process(target=get_trade_data,
-                                           args=(trade_section, output_queue, self.pre_trade_section_lines))
-                psutil_process = psutil.Process(trade_process.pid)
-                if sys.platform == "win32":
-                    psutil_process.nice(psutil.IDLE_PRIORITY_CLASS)
-                    psutil_process.ionice(psutil.IOPRIO_LOW)
-                else:
-                    psutil_process.nice(10)
-                    psutil_process.ionice(psutil.IOPRIO_CLASS_IDLE)
-
-                logging.debug("Starting parsing subprocess")
-                trade_process.start()
-                wait_icon_angle = 0
-
-                while trade_process.is_alive():
-                    self.do_wait_icon(wait_icon_angle)
-                    wait_icon_angle -= 12
-                    time.sleep(0.05)
-
-                trade_data = output_queue.get()
-                trade_process.join()
-                trade_process.close()
-                logging.debug("Parsing process complete")
-                self.on_parse_complete(trade_data)
-            except IndexError as e:
-                util.show_error(e, "Can't read file! " + error_message)
-            except Exception as e:
-                error_message = "Unexpected error: " + error_message
-                print(type(e), e, e.__context__)
-                util.show_error(e, "Can't read file! " + error_message)
-                raise e
+                shared, section = handoff.share_section(save.trade_section)
+            except OSError as e:
+                logging.warning("Could not share the trade section, sending it instead: %s" % e)
+                shared, section = None, save.trade_section
+            job = ParseJob(None, save, cache_key, shared, kill_to_cancel=self.config["legacyParser"])
 
             try:
+                # Parse the save file in the parse worker process, without blocking the UI thread
+                logging.debug("Sending save to the parse worker")
+                job.connection = self.parse_worker.submit(job.id, section, save.pre_trade_section_lines,
+                                                          self.config["legacyParser"], self.config["parseWorkers"],
+                                                          self.metrics.enabled, self.metrics.trace_memory)
+            except OSError as e:
+                job.release()
+                util.show_error(e, "Can't start parsing the save file: %s" % e)
                 self.draw_map(True)
-            except InvalidTradeNodeException as e:
-                util.show_error("Invalid trade node index: %s" % e,
-                                "Save file contains invalid trade node info. " +
-                                "If your save is from a modded game, please indicate the mod folder and try again.")
-
-    def on_parse_complete(self, trade_data):
-        self.node_data = trade_data["nodeData"]
-        self.max_local = trade_data["maxLocal"]
-        self.max_current = trade_data["maxCurrent"]
-        self.max_incoming = trade_data["maxIncoming"]
-        self.get_node_data()
-
-    def do_wait_icon(self, angle=0):
-
-        my = self.h / 2 - self.paneHeight + 40
-        mx = self.w / 2
-        radius = 16
-        arcs = [self.ui.canvas.create_arc(mx - radius, my - radius, mx + radius, my + radius,
-                                          fill=WHITE, outline=WHITE, start=angle),
-                self.ui.canvas.create_arc(mx - radius, my - radius, mx + radius, my + radius,
-                                          fill=WHITE, outline=WHITE, start=(angle + 180))]
-
-        self.ui.canvas.itemconfig(arcs[0], start=angle)
-        self.ui.canvas.itemconfig(arcs[1], start=angle + 180)
-        self.ui.canvas.update_idletasks()
-
-        for arc in arcs:
-            self.ui.canvas.delete(arc)
+                return
+
+            self.parse_job = job
+            self.root.after(PROGRESS_INTERVAL, self.poll_parse_job, job)
+            return True
+
+    def cancel_parse_job(self):
+        """Stop parsing the save that is being parsed, if any"""
+
+        job = self.parse_job
+        if job is None:
+            return
+        logging.info("Cancelling parse job %i" % job.id)
+        self.parse_job = None
+        self.parse_worker.cancel(job.id, kill=job.kill_to_cancel)
+        job.release()
+        self.hide_progress()
+        # Don't leave the wait message or the nodes streamed so far of the cancelled save on the map
+        if job.network is not None and self.renderer.network is job.network:
+            self.renderer.network = None
+        self.clear_map()
+
+    def poll_parse_job(self, job):
+        """Handle the messages sent by the parse worker so far, until the result of job arrives"""
+
+        if job is not self.parse_job:
+            return
+        try:
+            while job.connection.poll():
+                message = job.connection.recv()
+                if message[1] != job.id:
+                    logging.debug("Dropping %s message of cancelled parse job %i" % (message[0], message[1]))
+                elif message[0] == "progress":
+                    self.show_progress(*message[2:])
+                elif message[0] == "nodes":
+                    self.draw_streamed_nodes(job, message[2])
+                else:
+                    self.finish_parse_job(self.read_result(message[2]))
+                    return
+        except (EOFError, OSError) as e:
+            logging.error("Parse worker ended without a result: %r" % e)
+            util.show_error("Parse worker ended without a result", "Can't read file! The parsing process of %s "
+                            "stopped unexpectedly." % APP_NAME)
+            self.parse_worker.process.join(1)
+            self.parse_worker.ensure_running()
+            self.finish_parse_job(None)
+            return
+
+        self.root.after(PROGRESS_INTERVAL, self.poll_parse_job, job)
+
+    def draw_streamed_nodes(self, job, nodes):
+        """Draw the nodes parsed so far and their incoming routes"""
+
+        if not job.streaming:
+            return
+        try:
+            if job.network is None:
+                self.ui.canvas.delete("message")
+                with self.metrics.stage("game-data"):
+                    self.get_node_data()
+                job.network = TradeNetwork([name for name, _location in self.renderer.trade_nodes])
+                self.metrics.record("first-nodes", time.time() - job.started)
+            job.network.add_nodes(nodes)
+            self.renderer.network = job.network
+            self.draw_map()
+        except Exception as e:
+            # Only a preview, leave it to the complete result to report the problem
+            logging.warning("Not drawing the map while parsing: %r" % e)
+            job.streaming = False
+
+    def read_result(self, result):
+        """Get the trade data out of a result sent by the parse worker"""
+
+        if not isinstance(result, handoff.TradeDataHandle):
+            return result
+        try:
+            return handoff.open_trade_data(result)
+        except (OSError, ValueError) as e:
+            logging.error("Could not read the trade data from the parse worker: %s" % e)
+            return None
+
+    def finish_parse_job(self, trade_data):
+        """Show the result of the parsing process, or an empty map if it failed"""
+
+        job = self.parse_job
+        self.parse_job = None
+        job.release()
+        self.hide_progress()
+        self.ui.canvas.delete("message")
+        logging.debug("Parsing process complete")
+
+        error_message = f"{APP_NAME} could not parse this file. You might be trying to open a corrupted save, " + \
+                        "or a save created with an unsupported mod or game version. "
+        try:
+            if trade_data is None:
+                if job.network is not None and self.renderer.network is job.network:
+                    self.renderer.network = None
+                self.draw_map(True)
+                return
+            worker_metrics = trade_data.pop("metrics", None)
+            if worker_metrics:
+                self.metrics.add(worker_metrics)
+                self.metrics.record("transfer", time.time() - worker_metrics["sent_at"])
+            save = job.save
+            self.trade_cache.put(job.cache_key, {"header": save.header, "date": save.date, "player": save.player,
+                                                 "tradeData": trade_data})
+            # The streamed nodes are already on the map, just rescale them to the final max values
+            streamed = job.network is not None and job.streaming
+            self.on_parse_complete(trade_data, load_game_data=not streamed)
+            self.draw_trade_map(clear=not streamed)
+        except IndexError as e:
+            util.show_error(e, "Can't read file! " + error_message)
+        except Exception as e:
+            error_message = "Unexpected error: " + error_message
+            print(type(e), e, e.__context__)
+            util.show_error(e, "Can't read file! " + error_message)
+            raise e
+        finally:
+            self.write_metrics()
+
+    def show_progress(self, stage, done, total):
+        """Show how far along the parsing process is, with an estimate of the time left when it knows its total"""
+
+        bar = self.ui.progress_bar
+        if total:
+            fraction = done / total
+            bar.stop()
+            bar.config(mode="determinate", value=fraction)
+            text = "%s: %i%%" % (stage.capitalize(), 100 * fraction)
+            if fraction > 0:
+                elapsed = time.time() - self.parse_job.started
+                text += ", about %i s left" % ceil(elapsed * (1 - fraction) / fraction)
+        else:
+            if str(bar.cget("mode")) != "indeterminate":
+                bar.config(mode="indeterminate")
+                bar.start(PROGRESS_INTERVAL)
+            text = "%s..." % stage.capitalize()
+
+        self.ui.progress_label.config(text=text)
+        self.ui.progress_label.grid()
+        bar.grid()
+
+    def hide_progress(self):
+        self.ui.progress_bar.stop()
+        self.ui.progress_bar.grid_remove()
+        self.ui.progress_label.grid_remove()
+
+    def draw_trade_map(self, clear=True):
+        try:
+            # Draw all at once when measuring, so the render stage covers all of it
+            with self.metrics.stage("render"):
+                self.draw_map(clear, batched=not self.metrics.enabled)
+            if self.renderer.network is not None:
+                self.metrics.count("render", "nodes", len(self.renderer.network))
+                self.metrics.count("render", "routes", len(self.renderer.network.route_value))
+            self.metrics.count("render", "canvas_items", len(self.ui.canvas.find_all()))
+        except InvalidTradeNodeException as e:
+            util.show_error("Invalid trade node index: %s" % e,
+                            "Save file contains invalid trade node info. " +
+                            "If your save is from a modded game, please indicate the mod folder and try again.")
+
+    def get_cache_key(self):
+        """Key under which the parsed trade data of the selected save file is cached"""
+
+        try:
+            return cache.file_key(self.config["savefile"], TradeParser.PARSER_VERSION, self.config["legacyParser"],
+                                  self.config["ironmanTokens"])
+        except OSError as e:
+            raise ReadError("could not be opened (%s)" % e)
+
+    def on_parse_complete(self, trade_data, load_game_data=True):
+        if load_game_data:
+            with self.metrics.stage("game-data"):
+                self.get_node_data()
+        try:
+            self.renderer.network = TradeNetwork.from_trade_data(trade_data, self.renderer.trade_nodes)
+        except KeyError as e:
+            self.renderer.network = None
+            util.show_error("Encountered unknown trade node %s!" % e,
+                            "An invalid trade node was encountered. Save file doesn't match" +
+                            " currently installed EU4 version, or incorrect mod selected.")
 
     def get_save_text(self):
-        """Extract the text from the selected save file"""
+        """Extract the header and the trade section text from the selected save file. Returns a SaveSection."""
 
         self.ui.canvas.create_text((self.map_thumb_size[0] / 2, self.map_thumb_size[1] / 2),
                                    text="Please wait... Save file is being processed...",
                                    fill="white",
-                                   font=SMALL_FONT)
+                                   font=SMALL_FONT,
+                                   tags="message")
         self.root.update()
         logging.debug("Reading save file %s" % os.path.basename(self.config["savefile"]))
 
-        with open(self.config["savefile"], encoding="latin-1", mode="r") as f:
-            try:
-                txt = f.read()
-            except UnicodeDecodeError:
-                return
+        try:
+            save = savefile.read_trade_section(self.config["savefile"], self.metrics, self.config["ironmanTokens"])
+        except (OSError, zipfile.BadZipFile) as e:
+            raise ReadError("could not be opened (%s)" % e)
 
-            txt = self.check_for_compression(txt)
-            self.check_for_ironman(txt)
-            self.check_for_version(txt)
-
-            if not txt.startswith("EU4txt"):
-                logging.error("Savefile starts with %s, not EU4txt" % txt[:10])
-                raise ReadError("appears to be in an invalid format")
-
-            for line in txt[:2000].split("\n"):
-                if "=" in line:
-                    key, val = line.split("=")
-                    if key == "date":
-                        self.date = val.strip('" \n')
-                    elif key == "player":
-                        self.player = val.strip('" \n')
-                    elif key == "speed":
-                        break
-
-            txt = txt.split("trade=")
-            self.pre_trade_section_lines = txt[0].count("\n")
-
-        return txt
-
-    @staticmethod
-    def check_for_ironman(txt):
-        if txt.startswith("EU4bin"):
-            raise ReadError("appears to be an Ironman save")
-
-    def check_for_compression(self, txt):
-        """Check whether the save file text is compressed. If so, return uncompressed text, otherwise return the text
-        unchanged """
-        if txt[:2] == "PK":
-            logging.info("Save file is compressed, unzipping...")
-            zipped_save = zipfile.ZipFile(self.config["savefile"])
-            filename = [x for x in zipped_save.namelist() if x.endswith(".eu4") or x == "gamestate"][0]
-            unzipped_save = zipped_save.open(filename)
-            txt = unzipped_save.read().decode("latin-1")
-            return txt
-        else:
-            return txt
+        self.set_save_info(save.header, save.date, save.player)
+        self.pre_trade_section_lines = save.pre_trade_section_lines
+
+        return save
+
+    def set_save_info(self, header, date, player):
+        self.check_for_version(header)
+        self.date = date
+        self.player = player
 
     def check_for_version(self, txt):
         version_tuple = re.findall(R"first=(\d+)\s+second=(\d+)\s+third=(\d+)", txt[:500])
@@ -625,16 +1092,7 @@ class TradeViz:
         logging.debug("Show zeroes toggled")
         self.config["showZeroRoutes"] = self.ui.show_zero_var.get()
         self.root.update()
-
-        if not self.zero_arrows and self.ui.show_zero_var.get():
-            self.draw_map()
-        else:
-            for itemId in self.zero_arrows:
-                if self.ui.show_zero_var.get():
-                    self.ui.canvas.itemconfig(itemId, state="normal")
-                else:
-                    self.ui.canvas.itemconfig(itemId, state="hidden")
-
+        self.draw_map()
         self.save_config()
 
     def nodes_show_changed(self, *_args):
@@ -645,6 +1103,10 @@ class TradeViz:
         self.config["arrowScale"] = self.ui.arrow_scale_var.get()
         self.draw_map()
 
+    def display_mode_changed(self, *_args):
+        self.config["displayMode"] = self.ui.display_mode_var.get()
+        self.draw_map()
+
     def mod_path_changed(self, *_args):
         self.config["lastModPath"] = self.ui.mod_path_var.get()
 
@@ -653,437 +1115,109 @@ class TradeViz:
 
         self.save_config()
         self.root.update()
+        if self.parse_job is not None:
+            self.parse_job.release()
+        self.parse_worker.stop()
         logging.info("Exiting... (%s)" % reason)
         logging.shutdown()
         self.root.quit()
 
-    def get_node_name(self, node_id):
-        node = self.trade_nodes[node_id - 1]
-        return node[0]
-
-    def get_node_location(self, node_id):
-        if node_id > len(self.trade_nodes) + 1:
-            raise InvalidTradeNodeException(node_id)
-        node = self.trade_nodes[node_id - 1]
-        province_id = node[1]
-
-        for loc in self.province_locations:
-            if loc[0] == province_id:
-                return loc[1:]
-
     def get_node_data(self):
         """Retrieve trade node and province information from the game or mod files"""
 
         logging.debug("Getting node data")
+        game_data = gamedata.load_game_data(self.config["installDir"], self.ui.mod_path_combo_box.get(),
+                                            self.game_data_cache)
 
-        trade_nodes = r"common/tradenodes/00_tradenodes.txt"
-        positions = r"map/positions.txt"
-
-        mod_path = self.ui.mod_path_combo_box.get()
-        mod_zip = mod_path.replace(".mod", ".zip")
-        mod_dir = mod_path.replace(".mod", "")
-
-        mod_type = ""
-        if mod_path and os.path.isdir(mod_dir):
-            mod_type = "dir"
-        elif os.path.exists(mod_zip):
-            mod_type = "zip"
-
-        # Get all trade node provinceIDs, modded or default
-        try:
-            if mod_type == "zip":
-                z = zipfile.ZipFile(mod_zip)
-                if os.path.normpath(trade_nodes) in z.namelist():
-                    logging.debug("Using tradenodes file from zipped mod")
-                    with z.open(trade_nodes) as f:
-                        txt = f.read()
-                else:
-                    trade_nodes_file = os.path.join(self.config["installDir"], trade_nodes)
-                    logging.debug("Using default tradenodes file")
-
-                    with open(trade_nodes_file, "r") as f:
-                        txt = f.read()
-
-            else:
-                if mod_type == "dir" and os.path.exists(os.path.join(mod_dir, trade_nodes)):
-                    trade_nodes_file = os.path.join(mod_dir, trade_nodes)
-                    logging.debug("Using tradenodes file from mod directory")
-                else:
-                    trade_nodes_file = os.path.join(self.config["installDir"], trade_nodes)
-                    logging.debug("Using default tradenodes file")
-
-                with open(trade_nodes_file, "r") as f:
-                    txt = f.read()
-        except IOError as e:
-            logging.critical("Could not find trade nodes file: %s" % e)
-
-        txt = util.remove_comments(txt)
-        trade_nodes = NodeGrammar.nodes.parseString(txt)
-        logging.info("%i tradenodes found in %i chars" % (len(trade_nodes), len(txt)))
-
-        for i, tradeNode in enumerate(trade_nodes):
-            trade_nodes[i] = (tradeNode["name"], tradeNode["location"])
-
-        self.trade_nodes = trade_nodes
-
-        # Now get province positions
-        try:
-            if mod_type == "zip":
-                z = zipfile.ZipFile(mod_zip)
-                if os.path.normpath(positions) in z.namelist():
-                    logging.debug("Using positions file from zipped mod")
-                    with z.open(positions) as f:
-                        txt = f.read()
-                else:
-                    trade_nodes_file = os.path.join(self.config["installDir"], positions)
-                    logging.debug("Using default tradenodes file")
-
-                    with open(trade_nodes_file, "r") as f:
-                        txt = f.read()
-            else:
-                if mod_type == "dir" and os.path.exists(os.path.join(mod_dir, positions)):
-                    positions_file = os.path.join(mod_dir, positions)
-                    logging.debug("Using positions file from mod directory")
-                else:
-                    positions_file = os.path.join(self.config["installDir"], positions)
-                    logging.debug("Using default positions file")
-
-                with open(positions_file, encoding="latin-1", mode="r") as f:
-                    txt = f.read()
-        except IOError as e:
-            logging.critical("Could not find locations file: %s" % e)
-
-        locations = re.findall(r"(\d+)=\s*{\s*position=\s*{\s*([\d.]*)\s*([\d.]*)", txt)
-        for i in range(len(locations)):
-            a, b, c = locations[i]
-
-            locations[i] = (int(a), float(b), self.map_height - float(c))  # invert y coordinate :)
-
-        self.province_locations = locations
-        logging.info("Found %i province locations" % len(self.province_locations))
-
-    def get_node_radius(self, node):
-        """Calculate the radius for a trade node given its value"""
-
-        if self.config["nodesShow"] == "Total value":
-            if "currentValue" in node:
-                value = node["currentValue"] / self.max_current
-            else:
-                value = 0
-        elif self.config["nodesShow"] == "Local value":
-            if "localValue" in node:
-                value = node["localValue"] / self.max_local
-            else:
-                value = 0
-        else:
-            logging.error("Invalid nodesShow option: %s" % self.config["nodesShow"])
-            value = 0
-
-        return 5 + int(7 * value)
-
-    def get_line_width(self, value) -> float:
-
-        arrow_scale_style = self.ui.arrow_scale_var.get()
-
-        if value <= 0:
-            return 1
-
-        elif arrow_scale_style == "Linear":
-            return int(ceil(10 * value / self.max_incoming))
-
-        elif arrow_scale_style == "Square root":
-            return int(round(10 * sqrt(value) / sqrt(self.max_incoming)))
-
-        elif arrow_scale_style == "Logarithmic":
-            return int(round(10 * log1p(value) / log1p(self.max_incoming)))
-
-    def intersects_node(self, node1, node2):
-        """
-        Check whether a trade route intersects a trade node circle (other than source and target nodes)
-        See http://mathworld.wolfram.com/Circle-LineIntersection.html
-        """
-
-        # TODO: clearer variable names in this section
-        for n, node3 in enumerate(self.trade_nodes):
-            nx, ny = self.get_node_location(n + 1)
-            data = self.node_data[node3[0]]
-
-            r = self.get_node_radius(data) / self.map_render_size_ratio
-
-            # assume circle center is at 0,0
-            x2, y2 = self.get_node_location(node1)
-            x1, y1 = self.get_node_location(node2)
-            x1 -= nx
-            y1 -= ny
-            x2 -= nx
-            y2 -= ny
-
-            if (x1, y1) == (0, 0) or (x2, y2) == (0, 0):
-                continue
-
-            d_area = x1 * y2 - x2 * y1
-            dx = x2 - x1
-            dy = y2 - y1
-            dr = sqrt(dx ** 2 + dy ** 2)
-            det = r ** 2 * dr ** 2 - d_area ** 2
-
-            if det > 0:
-                # Infinite line intersects, check whether the center node is inside the rectangle
-                # defined by the other nodes.
-                if min(x1, x2) < 0 < max(x1, x2) and min(y1, y2) < 0 < max(y1, y2):
-                    logging.debug("%s is intersected by a trade route between %s and %s" %
-                                  (self.get_node_name(n + 1), self.get_node_name(node1), self.get_node_name(node2)))
-                    return True
-
-    def draw_arrow(self, from_node, to_node, value, to_radius):
-        """Draw an arrow between two nodes on the map"""
-
-        if value <= 0 and not self.ui.show_zero_var.get():
-            return
-
-        x2, y2 = self.get_node_location(from_node)
-        x, y = self.get_node_location(to_node)
-        is_pacific = self.pacific_trade(x, y, x2, y2)
-
-        # adjust for target node radius
-        dx = x - x2
-        if is_pacific:
-            if x > x2:
-                dx = x2 - self.map_width - x
-            else:
-                dx = self.map_width - x + x2
-        dy = y - y2
-        radius_ratio = max(1.0, sqrt(dx ** 2 + dy ** 2))
-        radius_fraction = to_radius / radius_ratio
-
-        # adjust to stop at node circle's edge
-        x -= 3 * dx * radius_fraction
-        y -= 3 * dy * radius_fraction
-
-        # rescale to unit length
-        dx /= radius_ratio
-        dy /= radius_ratio
-
-        ratio = self.map_render_size_ratio
-        line_width = self.get_line_width(value)
-        arrow_shape = (max(8.0, line_width * 2), max(10.0, line_width * 2.5), max(5.0, line_width))
-        w = max(5 / ratio, 1.5 * line_width / ratio)
-        line_color = "#000" if value > 0 else "#ff0"
-
-        if not is_pacific:
-            center_of_line = ((x + x2) / 2 * ratio, (y + y2) / 2 * ratio)
-
-            if self.intersects_node(from_node, to_node):
-                d = 20
-                center_of_line = (center_of_line[0] + d, center_of_line[1] + d)
-                z1 = self.ui.canvas.create_line((x * ratio, y * ratio, center_of_line[0], center_of_line[1]),
-                                                width=line_width, arrow=tk.FIRST, arrowshape=arrow_shape,
-                                                fill=line_color)
-                z2 = self.ui.canvas.create_line((center_of_line[0], center_of_line[1], x2 * ratio, y2 * ratio),
-                                                width=line_width, fill=line_color)
-
-                z3 = self.ui.mapDraw.line((x * ratio, y * ratio, center_of_line[0], center_of_line[1]),
-                                          width=line_width, fill=line_color)
-                z4 = self.ui.mapDraw.polygon(
-                    (x * ratio, y * ratio,
-                     (x - w * dx + w * dy) * ratio, (y - w * dx - w * dy) * ratio,
-                     (x - w * dx - w * dy) * ratio, (y + w * dx - w * dy) * ratio
-                     ),
-                    outline=line_color, fill=line_color)
-
-                z5 = self.ui.mapDraw.line((center_of_line[0], center_of_line[1], x2 * ratio, y2 * ratio),
-                                          width=line_width, fill=line_color)
-
-                if value == 0:
-                    self.zero_arrows += [z1, z2, z3, z4, z5]
-
-            else:  # not intersects_node(from_node, to_node)
-                z1 = self.ui.canvas.create_line((x * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                                width=line_width, arrow=tk.FIRST, arrowshape=arrow_shape,
-                                                fill=line_color)
-
-                z2 = self.ui.mapDraw.line((x * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                          width=line_width, fill=line_color)
-
-                z3 = self.ui.mapDraw.polygon(
-                    (x * ratio, y * ratio,
-                     (x - w * dx + w * dy) * ratio, (y - w * dx - w * dy) * ratio,
-                     (x - w * dx - w * dy) * ratio, (y + w * dx - w * dy) * ratio
-                     ),
-                    outline=line_color, fill=line_color)
-
-                if value == 0:
-                    self.zero_arrows += [z1, z2, z3]
-
-            self.ui.arrowLabels.append([center_of_line, value])
-
-        else:  # Trade route crosses edge of map
-
-            if x < x2:  # Asia to America
-                z0 = self.ui.canvas.create_line((x * ratio, y * ratio, (-self.map_width + x2) * ratio, y2 * ratio),
-                                                width=1, fill=line_color, arrow=tk.FIRST, arrowshape=arrow_shape)
-                z1 = self.ui.canvas.create_line(((self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                                width=1, fill=line_color, arrow=tk.FIRST, arrowshape=arrow_shape)
-
-                z2 = self.ui.mapDraw.line((x * ratio, y * ratio, (-self.map_width + x2) * ratio, y2 * ratio),
-                                          width=1, fill=line_color)
-                z3 = self.ui.mapDraw.line(((self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                          width=1, fill=line_color)
-                z4 = self.ui.mapDraw.polygon(
-                    (x * ratio, y * ratio,
-                     (x - w * dx + w * dy) * ratio, (y - w * dx - w * dy) * ratio,
-                     (x - w * dx - w * dy) * ratio, (y + w * dx - w * dy) * ratio
-                     ),
-                    outline=line_color, fill=line_color)
-
-                # fraction of trade route left of "date line"
-                f = abs(self.map_width - float(x2)) / (self.map_width - abs(x - x2))
-                # y coordinate where trade route crosses date line
-                yf = y2 + f * (y - y2)
-
-                center_of_line = (x / 2 * ratio, (yf + y) / 2 * ratio)
-                if value == 0:
-                    self.zero_arrows += [z0, z1, z2, z3, z4]
-
-            else:  # Americas to Asia
-                z0 = self.ui.canvas.create_line((x * ratio, y * ratio, (self.map_width + x2) * ratio, y2 * ratio),
-                                                width=1, fill=line_color, arrow=tk.FIRST, arrowshape=arrow_shape)
-                z1 = self.ui.canvas.create_line(((-self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                                width=1, fill=line_color, arrow=tk.FIRST, arrowshape=arrow_shape)
-
-                z2 = self.ui.mapDraw.line((x * ratio, y * ratio, (self.map_width + x2) * ratio, y2 * ratio),
-                                          width=1, fill=line_color)
-                z3 = self.ui.mapDraw.line(((-self.map_width + x) * ratio, y * ratio, x2 * ratio, y2 * ratio),
-                                          width=1, fill=line_color)
-                z4 = self.ui.mapDraw.polygon(
-                    (x * ratio, y * ratio,
-                     (x - w * dx + w * dy) * ratio, (y - w * dx - w * dy) * ratio,
-                     (x - w * dx - w * dy) * ratio, (y + w * dx - w * dy) * ratio
-                     ),
-                    outline=line_color, fill=line_color)
-
-                f = abs(self.map_width - float(x)) / (self.map_width - abs(x - x2))
-                yf = y + f * (y2 - y)
-
-                center_of_line = ((self.map_width + x) / 2 * ratio, (yf + y) / 2 * ratio)
-
-            self.ui.arrowLabels.append([center_of_line, value])
-
-            if value == 0:
-                self.zero_arrows += [z0, z1, z2, z3, z4]
+        self.renderer.set_game_data(game_data.trade_nodes, game_data.province_locations)
 
     def clear_map(self, update=False):
-        self.ui.canvas.create_image((0, 0), image=self.province_image, anchor=tk.NW)
-        self.ui.drawImg = self.ui.map_img.convert("RGB")
-        self.ui.mapDraw = ImageDraw.Draw(self.ui.drawImg)
+        """Remove the trade network and any messages from the map"""
+
+        self.cancel_canvas_draw()
+        self.ui.canvas.delete("message")
+        self.ui.canvas_surface.clear()
         if update:
             self.ui.canvas.update()
 
-    def draw_map(self, clear=False):
+    def draw_map(self, clear=False, batched=True):
         """Top level method for redrawing the world map and trade network"""
 
         logging.debug("Drawing map..")
         t0 = time.time()
 
-        self.clear_map(clear)
+        self.cancel_canvas_draw()
+        if clear:
+            self.clear_map(True)
         self.ui.done = True
-        ratio = self.map_render_size_ratio
-        self.zero_arrows = []
-
-        # draw incoming trade arrows
-        t1 = time.time()
-        n_arrows = 0
-        self.ui.arrowLabels = []
-
-        for n, node in enumerate(self.trade_nodes):
-            _x, _y = self.get_node_location(n + 1)
-
-            try:
-                data = self.node_data[node[0]]
-
-                if "incomingValue" in data:
-                    for i, value in enumerate(data["incomingValue"]):
-                        from_node_nr = data["incomingFromNode"][i]
-                        if from_node_nr >= len(self.trade_nodes):
-                            continue
-                        self.draw_arrow(from_node_nr, n + 1, value, self.get_node_radius(data))
-                        n_arrows += 1
-            except KeyError as e:
-                util.show_error("Encountered unknown trade node %s!" % node[0],
-                                "An invalid trade node was encountered. Save file doesn't match" +
-                                " currently installed EU4 version, or incorrect mod selected.")
-                print(self.node_data)
-                raise e
-
-        logging.debug("Drew %i arrows in %.2fs" % (n_arrows, time.time() - t1))
-
-        # draw trade arrow labels
-        for [centerOfLine, value] in self.ui.arrowLabels:
-            if value > 0 or self.ui.show_zero_var.get():
-                value_str = "%i" % ceil(value) if (value >= 2 or value <= 0) else ("%.1f" % value)
-                z5 = self.ui.canvas.create_text(centerOfLine, text=value_str, fill=WHITE)
-                z6 = self.ui.mapDraw.text((centerOfLine[0] - 4, centerOfLine[1] - 4), value_str, fill=WHITE)
-
-                if value == 0:
-                    self.zero_arrows += [z5, z6]
-
-        # draw trade nodes and their current value
-        n_nodes = 0
-        for n, node in enumerate(self.trade_nodes):
-            x, y = self.get_node_location(n + 1)
-
-            data = self.node_data[node[0]]
-            s = self.get_node_radius(data)
-            trade_node_color = BLACK
-            v = 0
-
-            if self.config["nodesShow"] == "Total value":
-                if "currentValue" in data:
-                    v = data["currentValue"]
-                else:
-                    v = 0
-                trade_node_color = "#d00"
-            elif self.config["nodesShow"] == "Local value":
-                if "localValue" in data:
-                    v = data["localValue"]
-                else:
-                    v = 0
-                trade_node_color = "#90c"
-
-            digits = len("%i" % v)
-
-            self.ui.canvas.create_oval((x * ratio - s, y * ratio - s, x * ratio + s, y * ratio + s),
-                                       outline=trade_node_color, fill=trade_node_color)
-            self.ui.canvas.create_text((x * ratio, y * ratio), text=int(v), fill="white")
-
-            self.ui.mapDraw.ellipse((x * ratio - s, y * ratio - s, x * ratio + s, y * ratio + s),
-                                    outline=trade_node_color, fill=trade_node_color)
-            self.ui.mapDraw.text((x * ratio - 3 * digits, y * ratio - 4), "%d" % v, fill=WHITE)
-            n_nodes += 1
-        logging.debug("Drew %i nodes" % n_nodes)
-
-        self.ui.canvas.create_text((10, self.map_height * ratio - 60), anchor="nw",
-                                   text="Player: %s" % self.player, fill="white")
-
-        self.ui.canvas.create_text((10, self.map_height * ratio - 40), anchor="nw",
-                                   text="Date: %s" % self.date, fill="white")
-
-        self.ui.canvas.create_text((10, self.map_height * ratio - 20), anchor="nw",
-                                   text="Version: %s" % self.save_version, fill="white")
+        self.renderer.nodes_show = self.config["nodesShow"]
+        self.renderer.arrow_scale = self.ui.arrow_scale_var.get()
+        self.renderer.show_zero = self.ui.show_zero_var.get()
+
+        scene = maprender.DisplayList()
+        self.renderer.draw([scene], self.player, self.date, self.save_version)
+        # When zoomed in, only part of the map is drawn, so the display list to export is made when exporting instead
+        if self.zoom == 1:
+            self.ui.display_list = scene
+
+        self.ui.canvas_surface.begin()
+        supersampling = DISPLAY_MODES.get(self.config["displayMode"], 0)
+        if supersampling:
+            self.draw_raster(scene, supersampling)
+            self.finish_canvas_draw(t0)
+            return
 
-        self.ui.mapDraw.text((10, self.map_height * ratio - 44), "Player: %s" % self.player, fill=WHITE)
-        self.ui.mapDraw.text((10, self.map_height * ratio - 24), "Date: %s" % self.date, fill=WHITE)
+        self.ui.canvas.delete("raster")
+        self.ui.raster_image = None
+        if batched:
+            self.draw_canvas_batch(scene, 0, t0)
+        else:
+            scene.replay(self.ui.canvas_surface)
+            self.finish_canvas_draw(t0)
+
+    def draw_raster(self, scene, supersampling):
+        """Draw the trade network in view on a single image on the canvas, with the legend as canvas items"""
+
+        canvas = self.ui.canvas
+        origin = (0, 0)
+        if self.zoom != 1:
+            origin = (int(canvas.canvasx(0)), int(canvas.canvasy(0)))
+        overlay = maprender.draw_overlay(scene, self.map_thumb_size, origin, supersampling)
+        self.ui.raster_image = ImageTk.PhotoImage(overlay)
+
+        if canvas.find_withtag("raster"):
+            canvas.coords("raster", origin)
+            canvas.itemconfig("raster", image=self.ui.raster_image)
+        else:
+            canvas.create_image(origin, anchor=tk.NW, image=self.ui.raster_image, tags="raster")
+        for primitive, args in scene.items:
+            if primitive == "legend":
+                self.ui.canvas_surface.legend(*args)
+
+    def draw_canvas_batch(self, scene, start, t0):
+        """Draw the items of scene from start on, until the time for a batch is up, and schedule the next batch"""
+
+        self.canvas_draw = None
+        deadline = time.perf_counter() + RENDER_BATCH_TIME / 1000
+        while start < len(scene):
+            scene.replay(self.ui.canvas_surface, start, start + RENDER_BATCH_ITEMS)
+            start += RENDER_BATCH_ITEMS
+            if time.perf_counter() >= deadline:
+                break
+
+        if start < len(scene):
+            self.canvas_draw = self.root.after(1, self.draw_canvas_batch, scene, start, t0)
+        else:
+            self.finish_canvas_draw(t0)
 
+    def finish_canvas_draw(self, t0):
+        self.ui.canvas_surface.finish()
         logging.info("Finished drawing map in %.3f seconds" % (time.time() - t0))
 
-    def pacific_trade(self, x, y, x2, y2):
-        """Check whether a line goes around the east/west edge of the map"""
-
-        direct_dist = sqrt(abs(x - x2) ** 2 + abs(y - y2) ** 2)
-        x_dist_across = self.map_width - abs(x - x2)
-        dist_across = sqrt(x_dist_across ** 2 + abs(y - y2) ** 2)
-
-        return dist_across < direct_dist
+    def cancel_canvas_draw(self):
+        if self.canvas_draw is not None:
+            self.root.after_cancel(self.canvas_draw)
+            self.canvas_draw = None
 
     def save_map(self):
         """Export the current map as a .gif image"""
@@ -1095,29 +1229,237 @@ class TradeViz:
                                                     title="Save as..")
         if save_name:
             try:
-                self.ui.drawImg = self.ui.drawImg.convert("P", palette=Image.ADAPTIVE, dither=Image.NONE, colors=8)
-                self.ui.drawImg.save(save_name)
+                if self.zoom != 1:
+                    self.draw_export_list()
+                draw_img = self.ui.map_img.convert("RGB")
+                self.ui.display_list.replay(maprender.ImageSurface(ImageDraw.Draw(draw_img)))
+                draw_img = draw_img.convert("P", palette=Image.ADAPTIVE, dither=Image.NONE, colors=8)
+                draw_img.save(save_name)
             except Exception as e:
                 logging.error("Problem saving map image: %s" % e)
 
-    def click_map(self, *args):
-        x = args[0].x
-        y = args[0].y
-        self.zoomed = not self.zoomed
+    def draw_export_list(self):
+        """Record the whole trade network at the size of the exported image in the display list"""
 
-        logging.info("Map clicked at (%i, %i), self.zoomed is now %s" % (x, y, self.zoomed))
+        ratio, viewport = self.renderer.ratio, self.renderer.viewport
+        self.renderer.ratio, self.renderer.viewport = self.map_render_size_ratio, None
+        try:
+            self.ui.display_list = maprender.DisplayList()
+            self.renderer.draw([self.ui.display_list], self.player, self.date, self.save_version)
+        finally:
+            self.renderer.ratio, self.renderer.viewport = ratio, viewport
 
+    def click_map(self, event):
+        self.ui.canvas.scan_mark(event.x, event.y)
+        logging.debug("Map clicked at (%i, %i)" % (event.x, event.y))
 
-class InvalidTradeNodeException(Exception):
-    def __init__(self, msg):
-        Exception.__init__(self)
-        self.message = msg
+    def drag_map(self, event):
+        """Pan the zoomed in map"""
 
+        if self.zoom == 1:
+            return
+        self.ui.canvas.scan_dragto(event.x, event.y, gain=1)
+        if self.view_update is None:
+            self.view_update = self.root.after(VIEW_UPDATE_INTERVAL, self.update_view)
+
+    def wheel_map(self, event):
+        """Zoom in or out by one zoom level around the mouse pointer"""
+
+        step = 1 if event.num == 4 or event.delta > 0 else -1
+        level = min(max(ZOOM_LEVELS.index(self.zoom) + step, 0), len(ZOOM_LEVELS) - 1)
+        if ZOOM_LEVELS[level] != self.zoom and self.ui.tile_layer is not None:
+            self.set_zoom(ZOOM_LEVELS[level], event.x, event.y)
+
+    def set_zoom(self, zoom, x, y):
+        """Show the map at zoom times its normal size, keeping the point at x, y of the canvas in place"""
+
+        canvas = self.ui.canvas
+        map_x = canvas.canvasx(x) / self.renderer.ratio
+        map_y = canvas.canvasy(y) / self.renderer.ratio
+
+        self.zoom = zoom
+        ratio = self.map_render_size_ratio * zoom
+        self.renderer.ratio = ratio
+        width, height = self.map_width * ratio, self.map_height * ratio
+        canvas.configure(scrollregion=(0, 0, width, height))
+        canvas.xview_moveto((map_x * ratio - x) / width)
+        canvas.yview_moveto((map_y * ratio - y) / height)
+        canvas.itemconfig("map", state="normal" if zoom == 1 else "hidden")
+        logging.info("Zoomed to %ix" % zoom)
+        self.update_view()
+
+    def update_view(self):
+        """Show the map tiles in view, and redraw the trade network in and around the view"""
+
+        if self.view_update is not None:
+            self.root.after_cancel(self.view_update)
+            self.view_update = None
+
+        canvas = self.ui.canvas
+        x0, y0 = canvas.canvasx(0), canvas.canvasy(0)
+        x1, y1 = x0 + canvas.winfo_width(), y0 + canvas.winfo_height()
+        if self.zoom == 1:
+            if self.ui.tile_layer is not None:
+                self.ui.tile_layer.hide()
+            self.renderer.viewport = None
+        else:
+            self.ui.tile_layer.show(self.renderer.ratio, x0, y0, x1, y1)
+            # Draw a margin around the view, so there's something to see while dragging until the next update
+            margin = (x1 - x0) / 2
+            self.renderer.viewport = (x0 - margin, y0 - margin, x1 + margin, y1 + margin)
 
-class ReadError(Exception):
-    def __init__(self, msg):
-        Exception.__init__(self)
-        self.message = msg
+        if self.ui.done:
+            try:
+                self.draw_map()
+            except InvalidTradeNodeException as e:
+                logging.error("Invalid trade node index: %s" % e)
+
+
+class TileLayer:
+    """Shows the tiles of a TilePyramid that are in view on the canvas, below the trade network"""
+
+    def __init__(self, canvas, pyramid, max_images=TILE_IMAGES):
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.max_images = max_images
+        self.images = OrderedDict()  # (level width, column, row): PhotoImage
+        self.items = {}  # (column, row): canvas item of a tile shown at the current scale
+        self.scale = None
+
+    def image(self, scale, col, row):
+        key = (self.pyramid.level_size(scale)[0], col, row)
+        image = self.images.pop(key, None)
+        if image is None:
+            image = ImageTk.PhotoImage(self.pyramid.tile(scale, col, row))
+        self.images[key] = image
+        while len(self.images) > self.max_images:
+            self.images.popitem(last=False)
+        return image
+
+    def show(self, scale, x0, y0, x1, y1):
+        """Show the tiles of the map at scale that overlap the rectangle x0, y0, x1, y1 of the canvas"""
+
+        if scale != self.scale:
+            self.hide()
+            self.scale = scale
+
+        visible = set(self.pyramid.visible_tiles(scale, x0, y0, x1, y1))
+        for tile in [tile for tile in self.items if tile not in visible]:
+            self.canvas.delete(self.items.pop(tile))
+
+        size = self.pyramid.tile_size
+        for col, row in visible:
+            if (col, row) not in self.items:
+                self.items[col, row] = self.canvas.create_image((col * size, row * size), anchor=tk.NW, tags="tile",
+                                                                image=self.image(scale, col, row))
+        self.canvas.tag_lower("tile")
+
+    def hide(self):
+        self.canvas.delete("tile")
+        self.items = {}
+        self.scale = None
+
+
+class CanvasSurface:
+    """Draws map primitives on the Tk canvas, updating the items of earlier draws in place"""
+
+    # Canvas tags of the layers on top of the map image, from bottom to top
+    LAYERS = ("route", "label", "node", "legend")
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.items = {}  # key: (arguments it was drawn with, item ids)
+        self.drawn = set()
+
+    def begin(self):
+        self.drawn = set()
+
+    def finish(self):
+        """Remove the items that weren't drawn since begin(), and restore the order of the layers"""
+
+        for key in [key for key in self.items if key not in self.drawn]:
+            self.canvas.delete(*self.items.pop(key)[1])
+        for layer in self.LAYERS:
+            self.canvas.tag_raise(layer)
+
+    def clear(self):
+        for layer in self.LAYERS:
+            self.canvas.delete(layer)
+        self.canvas.delete("raster")
+        self.items = {}
+
+    def route(self, key, lines, _head, arrow_shape, color):
+        self.drawn.add(key)
+        previous = self.items.get(key)
+
+        if previous is not None and len(previous[0][0]) == len(lines):
+            old_lines, old_shape, old_color = previous[0]
+            items = previous[1]
+            for item, (points, width, arrow), (old_points, old_width, old_arrow) in zip(items, lines, old_lines):
+                if points != old_points:
+                    self.canvas.coords(item, points)
+                if (width, arrow, arrow_shape, color) != (old_width, old_arrow, old_shape, old_color):
+                    self.canvas.itemconfig(item, width=width, fill=color, arrow=tk.FIRST if arrow else tk.NONE,
+                                           arrowshape=arrow_shape)
+        else:
+            if previous is not None:
+                self.canvas.delete(*previous[1])
+            items = [self.canvas.create_line(points, width=width, fill=color, arrow=tk.FIRST if arrow else tk.NONE,
+                                             arrowshape=arrow_shape, tags="route")
+                     for points, width, arrow in lines]
+
+        self.items[key] = ((lines, arrow_shape, color), items)
+        return items
+
+    def route_label(self, key, center, text):
+        self.drawn.add(key)
+        previous = self.items.get(key)
+
+        if previous is not None:
+            (old_center, old_text), items = previous
+            if center != old_center:
+                self.canvas.coords(items[0], center)
+            if text != old_text:
+                self.canvas.itemconfig(items[0], text=text)
+        else:
+            items = [self.canvas.create_text(center, text=text, fill=WHITE, tags="label")]
+
+        self.items[key] = ((center, text), items)
+        return items
+
+    def node(self, key, center, radius, color, value):
+        self.drawn.add(key)
+        previous = self.items.get(key)
+        x, y = center
+
+        if previous is not None:
+            (old_center, old_radius, old_color, old_value), (oval, text) = previous
+            if (center, radius) != (old_center, old_radius):
+                self.canvas.coords(oval, (x - radius, y - radius, x + radius, y + radius))
+                self.canvas.coords(text, center)
+            if color != old_color:
+                self.canvas.itemconfig(oval, outline=color, fill=color)
+            if int(value) != int(old_value):
+                self.canvas.itemconfig(text, text=int(value))
+        else:
+            oval = self.canvas.create_oval((x - radius, y - radius, x + radius, y + radius), outline=color, fill=color,
+                                           tags="node")
+            text = self.canvas.create_text((x, y), text=int(value), fill="white", tags="node")
+
+        self.items[key] = ((center, radius, color, value), (oval, text))
+
+    def legend(self, bottom, player, date, version):
+        # Keep the legend in the bottom left corner of the view when the map is zoomed in
+        left = 10
+        if self.canvas.winfo_ismapped():
+            left += max(0.0, self.canvas.canvasx(0))
+            bottom = min(bottom, self.canvas.canvasy(self.canvas.winfo_height()))
+        self.canvas.delete("legend")
+        self.canvas.create_text((left, bottom - 60), anchor="nw", text="Player: %s" % player, fill="white",
+                                tags="legend")
+        self.canvas.create_text((left, bottom - 40), anchor="nw", text="Date: %s" % date, fill="white", tags="legend")
+        self.canvas.create_text((left, bottom - 20), anchor="nw", text="Version: %s" % version, fill="white",
+                                tags="legend")
 
 
 class ParseError(Exception):
@@ -1127,10 +1469,15 @@ class ParseError(Exception):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        arg = sys.argv[1]
+    for arg in sys.argv[1:]:
         if arg in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
             DEBUG_LEVEL = eval("logging." + arg)
+        elif arg == "--metrics":
+            METRICS_FILE = "tradeviz_metrics.jsonl"
+        elif arg.startswith("--metrics="):
+            METRICS_FILE = arg.split("=", 1)[1]
+        elif arg == "--metrics-memory":
+            METRICS_TRACE_MEMORY = True
 
     if os.path.exists("tradeviz.log"):
         os.remove("tradeviz.log")
@@ -1,8 +1,6 @@
 import sys
 import os
 import logging
-import tkinter as tk
-import tkinter.messagebox
 
 win_reg_key =\
     "S-1-5-21-1472195844-1040877506-3863951423-1002\\System\\GameConfigStore\\Children\\" +\
@@ -52,7 +50,10 @@ def sign(v):
 
 
 def show_error(log_message, user_message):
+    # Tk is imported here, so the rest of the program can run headless
+    import tkinter.messagebox
+
     if not user_message:
         user_message = log_message
     logging.error(f"{user_message}\n{log_message}")
-    tk.messagebox.showerror("Error", user_message)
+    tkinter.messagebox.showerror("Error", user_message)